@@ -0,0 +1,270 @@
+"""Memory allocated per frame by the game, subsystem by subsystem.
+
+Scenarios are played on the headless backend with tracemalloc on.  For each
+frame, and for each load/update/draw method of main.py and draw_textbox,
+it measures:
+
+- peak: the most memory held at once during the calls, above what was held
+  before, which is 0 only when the calls allocated nothing;
+- kept: what the calls allocated and didn't free.
+
+Methods are measured one per replay of the scenario, which plays the same
+each time, so that measuring one doesn't count towards another.  Peaks are
+inclusive: what draw_textbox allocates also counts for GuiMenu.draw.
+
+    python allocprof.py                         # built-in scenarios
+    python allocprof.py sessions/*.txt          # recorded inputs
+    python allocprof.py --budget 0              # exit 1 if a frame allocates
+
+The budget is checked on steady frames: those where the scenes and menus
+are the same as on the frames before, after --warmup frames.  Scenarios are
+first replayed WARMUP_PLAYS times unmeasured, for what only allocates the
+first times it runs: the interpreter's free lists, and CPython 3.11 adapting
+the code of a function during its first 8 calls.
+"""
+import argparse
+import contextlib
+import functools
+import gc
+import inspect
+import os
+import sys
+import tracemalloc
+
+import numpy as np
+
+import headless
+import main
+
+
+KEY = {name: 1 << i for i, name in enumerate(headless.KEYS)}
+WARMUP_PLAYS = 8
+
+
+def hold(frames, *names):
+    return [sum(KEY[name] for name in names)] * frames
+
+
+def show_credits(app):
+    app.scene_stack.push_menu(main.CreditMenu(12))
+
+
+# name: (level, setup, inputs)
+SCENARIOS = {
+    'tutorial': (0, None, hold(300)),
+    'play': (0, None, hold(1, 'ENTER') + hold(10) + (
+        hold(8, 'RIGHT') + hold(1, 'UP') + hold(30) + hold(8, 'LEFT')
+        + hold(20)) * 5),
+    'pause': (0, None, hold(1, 'ENTER') + hold(10) + hold(1, 'TAB') + hold(10)
+              + hold(120, 'DOWN') + hold(120, 'UP')),
+    'sacrifice': (1, None, hold(1, 'ENTER') + hold(10)
+                  + hold(120, 'DOWN') + hold(120, 'UP')),
+    'credits': (0, show_credits, hold(300)),
+}
+
+
+def subsystems():
+    """The (owner, name) of every function that gets measured."""
+    found = [(main, 'draw_textbox')]
+    for cls in vars(main).values():
+        if inspect.isclass(cls) and cls.__module__ == main.__name__:
+            found += [(cls, name) for name in ('load', 'update', 'draw')
+                      if name in vars(cls)]
+    return found
+
+
+def subsystem_name(owner, name):
+    return name if owner is main else '{}.{}'.format(owner.__name__, name)
+
+
+class Meter:
+    def __init__(self):
+        self.overhead = (0, 0)
+        self.reset()
+        calibrate = self.wrap(lambda: None)
+        for _ in range(10):
+            self.reset()
+            calibrate()
+        self.overhead = (self.peak, self.kept)
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.peak = 0
+        self.kept = 0
+
+    def wrap(self, function):
+        signature = inspect.signature(function)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if kwargs:
+                # Passing keywords on allocates, positional arguments don't
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                args = bound.args
+
+            # The first call leaves a tuple in the free list for the next
+            # ones, so that the only thing measuring allocates is `start`,
+            # which the calibration takes off
+            tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            start = tracemalloc.get_traced_memory()[0]
+            try:
+                return function(*args)
+            finally:
+                current, peak = tracemalloc.get_traced_memory()
+                self.calls += 1
+                self.peak = max(self.peak, peak - start - self.overhead[0])
+                self.kept += current - start - self.overhead[1]
+        return wrapper
+
+
+@contextlib.contextmanager
+def measuring(meter, owner, name):
+    function = vars(owner)[name]
+    setattr(owner, name, meter.wrap(function))
+    try:
+        yield
+    finally:
+        setattr(owner, name, function)
+
+
+class GCCounter:
+    def __init__(self):
+        self.collections = 0
+
+    def __call__(self, phase, info):
+        if phase == 'start':
+            self.collections += 1
+
+
+def frame(app):
+    app.update()
+    app.draw()
+
+
+def play(backend, scenario, measure=None):
+    """Play a scenario, measuring `measure` or whole frames; return the
+    (calls, peak, kept, steady) arrays, one value per frame, and the garbage
+    collections of steady frames."""
+    level, setup, inputs = scenario
+    meter = Meter()
+    calls, peak, kept, steady = (np.zeros(len(inputs), dtype)
+                                 for dtype in (int, int, int, bool))
+    gc_counter = GCCounter()
+
+    app = headless.HeadlessApp(backend, level)
+    if setup is not None:
+        setup(app)
+
+    step = meter.wrap(frame) if measure is None else frame
+    wrapped = measuring(meter, *measure) if measure is not None else contextlib.nullcontext()
+    collections = 0
+    last = None
+    with wrapped:
+        for i, keys in enumerate(inputs):
+            app.activate()
+            backend.set_input(keys)
+            meter.reset()
+            gc_counter.collections = 0
+            gc.callbacks.append(gc_counter)
+            try:
+                step(app)
+            except headless.Quit:
+                break
+            finally:
+                gc.callbacks.remove(gc_counter)
+
+            stack = app.scene_stack
+            state = (stack.top_scene(), stack.top_menu())
+            calls[i], peak[i], kept[i] = meter.calls, meter.peak, meter.kept
+            steady[i] = state == last
+            last = state
+            if steady[i]:
+                collections += gc_counter.collections
+    return calls, peak, kept, steady, collections
+
+
+def settle(steady, warmup):
+    """Only keep steady frames that follow `warmup` steady frames."""
+    run = 0
+    settled = np.zeros_like(steady)
+    for i, is_steady in enumerate(steady):
+        run = run + 1 if is_steady else 0
+        settled[i] = run > warmup
+    return settled
+
+
+def profile(scenario, warmup=10, backend=None):
+    """Measure a scenario; return {subsystem: (calls, peak, kept)} per
+    settled frame, with 'frame' for whole frames, and the number of
+    garbage collections during steady frames."""
+    if backend is None:
+        backend = headless.HeadlessPyxel()
+
+    tracemalloc.start()
+    try:
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for _ in range(WARMUP_PLAYS):
+                play(backend, scenario)
+            calls, peak, kept, steady, collections = play(backend, scenario)
+            settled = settle(steady, warmup)
+            results = {'frame': (calls[settled], peak[settled], kept[settled])}
+            for owner, name in subsystems():
+                calls, peak, kept, _, _ = play(backend, scenario, (owner, name))
+                if calls[settled].any():
+                    results[subsystem_name(owner, name)] = (
+                        calls[settled], peak[settled], kept[settled])
+    finally:
+        tracemalloc.stop()
+    return results, collections
+
+
+def over_budget(results, budget):
+    """Settled frames allocating more than `budget` bytes at once."""
+    _, peak, _ = results['frame']
+    return int((peak > budget).sum())
+
+
+def report(name, results, collections, budget=None):
+    calls, peak, kept = results['frame']
+    print("{}: {} settled frames, {} garbage collections".format(
+        name, len(peak), collections))
+    print("  {:<28} {:>7} {:>9} {:>9} {:>9}".format(
+        'subsystem', 'calls/f', 'peak avg', 'peak max', 'kept/f'))
+    for subsystem, (calls, peak, kept) in sorted(
+            results.items(), key=lambda item: -item[1][1].max(initial=0)):
+        if len(peak) == 0:
+            continue
+        print("  {:<28} {:>7.1f} {:>8.0f}B {:>8d}B {:>8.0f}B".format(
+            subsystem, calls.mean(), peak.mean(), peak.max(), kept.mean()))
+    if budget is not None:
+        over = over_budget(results, budget)
+        print("  {} frames over the budget of {}B".format(over, budget))
+        return over == 0
+    return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Allocations per frame")
+    parser.add_argument('sessions', nargs='*', help="recorded inputs, played from level 0")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="built-in scenarios to play, all by default")
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--budget', type=int, metavar='BYTES',
+                        help="most bytes a settled frame may allocate")
+    args = parser.parse_args()
+
+    scenarios = {filename: (0, None, list(headless.load_inputs(filename)))
+                 for filename in args.sessions}
+    if not scenarios or args.scenario:
+        for name in args.scenario or sorted(SCENARIOS):
+            scenarios[name] = SCENARIOS[name]
+
+    backend = headless.HeadlessPyxel()
+    ok = True
+    for name, scenario in scenarios.items():
+        results, collections = profile(scenario, args.warmup, backend)
+        ok &= report(name, results, collections, args.budget)
+    sys.exit(0 if ok else 1)
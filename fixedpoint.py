@@ -0,0 +1,149 @@
+"""Step many players at once with the integer physics of FixedPlayer.
+
+Positions and velocities are int64 arrays in 1/SUBPIXEL pixel units, and
+every operation is integer numpy math, so results match FixedPlayer.update
+exactly and don't depend on the machine.  Tiles outside of the level grids
+count as empty.
+"""
+import numpy as np
+
+import headless
+import main
+
+
+S = main.SUBPIXEL
+T = main.TILE_FX
+
+KEY_BITS = {name: 1 << i for i, name in enumerate(headless.KEYS)}
+
+
+class Players:
+    def __init__(self, x, y):
+        """x and y are the starting positions, in pixels."""
+        self.x = np.asarray(x, np.int64) * S
+        self.y = np.asarray(y, np.int64) * S
+        self.vx = np.zeros_like(self.x)
+        self.vy = np.zeros_like(self.y)
+        self.w = 8 * S
+        self.h = 8 * S
+
+
+def tiles_at(tiles, x, y):
+    """Gather one tile per player from a (H, W) grid or a (B, H, W) batch."""
+    H, W = tiles.shape[-2:]
+    inside = (x >= 0) & (x < W) & (y >= 0) & (y < H)
+    xc = np.clip(x, 0, W-1)
+    yc = np.clip(y, 0, H-1)
+    if tiles.ndim == 2:
+        found = tiles[yc, xc]
+    else:
+        found = tiles[np.arange(len(x)), yc, xc]
+    return np.where(inside, found, 0)
+
+
+def walls_at(tiles, x, y):
+    found = tiles_at(tiles, x, y)
+    return (found == main.TILE_BLOCK) | (found == main.TILE_LOCK)
+
+
+def apply_friction(v, amount):
+    return np.where(v > 0, np.maximum(0, v - amount), np.minimum(0, v + amount))
+
+
+def trunc_div(a, b):
+    return np.where(a >= 0, a // b, -((-a) // b))
+
+
+# The col_* methods of FixedPlayer, returning 0 instead of False
+
+def col_left(p, tiles, x, y):
+    tx = (x - S) // T
+    hit = walls_at(tiles, tx, y // T) | walls_at(tiles, tx, (y + p.h - S) // T)
+    return np.where(hit, (tx + 1) * T, 0)
+
+
+def col_right(p, tiles, x, y):
+    tx = (x + p.w) // T
+    hit = walls_at(tiles, tx, y // T) | walls_at(tiles, tx, (y + p.h - S) // T)
+    return np.where(hit, tx * T, 0)
+
+
+def col_top(p, tiles, x, y):
+    ty = (y - S) // T
+    hit = walls_at(tiles, x // T, ty) | walls_at(tiles, (x + p.w - S) // T, ty)
+    return np.where(hit, (ty + 1) * T, 0)
+
+
+def col_bottom(p, tiles, x, y):
+    ty = (y + p.h) // T
+    hit = walls_at(tiles, x // T, ty) | walls_at(tiles, (x + p.w - S) // T, ty)
+    return np.where(hit, ty * T, 0)
+
+
+def step(p, tiles, held, pressed, features):
+    """Advance every player by one frame.
+
+    `held` and `pressed` are arrays of key masks, as in headless, for the
+    keys that are down and those that went down this frame.  Returns the
+    tile under the center of each player."""
+    def key(mask, name):
+        return (mask & KEY_BITS[name]) != 0
+
+    gravity = features['gravity']
+    collide = features['collisions']
+    zeros = np.zeros_like(p.x)
+    x, y, vx, vy = p.x, p.y, p.vx, p.vy
+
+    # Physics
+    y = y + vy
+    if features['friction']:
+        vy = apply_friction(vy, main.FRICTION_AIR_FX)
+
+    # Collisions
+    top = col_top(p, tiles, x, y) if collide else zeros
+    hit = top != 0
+    vy = np.where(hit, np.maximum(0, vy), vy)
+    y = np.where(hit, top, y)
+    if not gravity:
+        vy = np.where(hit & key(pressed, 'DOWN'), main.PLAYER_SPEED_FX, vy)
+
+    bottom = col_bottom(p, tiles, x, y) if collide else zeros
+    hit = bottom != 0
+    if gravity:
+        vy = np.where(hit, vy, vy + main.GRAVITY_FX)
+    vy = np.where(hit, np.minimum(0, vy), vy)
+    y = np.where(hit, bottom - p.h, y)
+    if gravity:
+        if features['jump']:
+            vy = np.where(hit & key(pressed, 'UP'), -main.PLAYER_JUMP_FX, vy)
+    else:
+        vy = np.where(hit & key(pressed, 'UP'), -main.PLAYER_SPEED_FX, vy)
+
+    x = x + vx
+    if features['friction']:
+        on_ground = hit if gravity else np.zeros_like(hit)
+        vx = apply_friction(
+            vx, np.where(on_ground, main.FRICTION_GROUND_FX, main.FRICTION_AIR_FX))
+
+    left = col_left(p, tiles, x, y) if collide else zeros
+    hit = left != 0
+    x = np.where(hit, left, x)
+    vx = np.where(hit, np.maximum(0, vx), vx)
+    if not gravity and features['right']:
+        vx = np.where(hit & key(pressed, 'RIGHT'), main.PLAYER_SPEED_FX, vx)
+    if gravity and features['left']:
+        vx = np.where(~hit & key(held, 'LEFT'), -main.PLAYER_SPEED_FX, vx)
+
+    right = col_right(p, tiles, x, y) if collide else zeros
+    hit = right != 0
+    x = np.where(hit, right - p.w, x)
+    vx = np.where(hit, np.minimum(0, vx), vx)
+    if not gravity and features['left']:
+        vx = np.where(hit & key(pressed, 'LEFT'), -main.PLAYER_SPEED_FX, vx)
+    if gravity and features['right']:
+        vx = np.where(~hit & key(held, 'RIGHT'), main.PLAYER_SPEED_FX, vx)
+
+    p.x, p.y, p.vx, p.vy = x, y, vx, vy
+
+    return tiles_at(tiles, trunc_div(x + p.w//2, S) // 8,
+                    trunc_div(y + p.h//2, S) // 8)
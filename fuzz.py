@@ -0,0 +1,376 @@
+"""Input fuzzer.
+
+Runs random and mutated input streams through the game headless on a process
+pool, and looks for exceptions, softlocks and broken invariants.  Failing
+inputs are minimized and written as repro files that can be replayed with
+`python fuzz.py --replay FILE`, from the level and with the physics they
+were found with.
+"""
+import argparse
+import contextlib
+import hashlib
+import multiprocessing
+import os
+import random
+import time
+import traceback
+
+import headless
+import main
+
+
+FUZZ_OUT = 'fuzz_out'
+
+# Key combinations a player would plausibly hold, with their weights
+COMBOS = [
+    (1 << headless.HeadlessPyxel.KEY_RIGHT, 6),
+    (1 << headless.HeadlessPyxel.KEY_LEFT, 4),
+    (1 << headless.HeadlessPyxel.KEY_UP, 3),
+    (1 << headless.HeadlessPyxel.KEY_DOWN, 2),
+    ((1 << headless.HeadlessPyxel.KEY_UP) | (1 << headless.HeadlessPyxel.KEY_RIGHT), 3),
+    ((1 << headless.HeadlessPyxel.KEY_UP) | (1 << headless.HeadlessPyxel.KEY_LEFT), 2),
+    (1 << headless.HeadlessPyxel.KEY_ENTER, 4),
+    (1 << headless.HeadlessPyxel.KEY_TAB, 1),
+    (0, 4),
+]
+COMBO_KEYS = [keys for keys, _ in COMBOS]
+COMBO_WEIGHTS = [weight for _, weight in COMBOS]
+
+# What has been given up before the level we start fuzzing from
+PRIOR_SACRIFICES = ['animations', 'windows', 'sprites', 'tutorial', 'friction',
+                    'rendering', 'keys', 'locks', 'left']
+
+
+_app = None
+_start = (0, (), False)
+
+
+def _init_worker(level=0, fixed_point=False):
+    global _app, _start
+    _start = (level, tuple(PRIOR_SACRIFICES[:max(0, level-1)]), fixed_point)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        _app = headless.HeadlessApp(headless.HeadlessPyxel(), *_start)
+
+
+# LevelScene.update restarts the level once the top left of the player is
+# outside of tiles -2 to W+1, so its center is still alive from tile -2 to W+2
+MARGIN_BEFORE = 2
+MARGIN_AFTER = 3
+
+
+def reachable_tiles(level_map, x, y, bounds, walls):
+    """Flood fill of the tiles around (x, y) that aren't in `walls`, within
+    `bounds`, (min_x, max_x, min_y, max_y), and the margin outside of the
+    level where the player is still alive."""
+    W, H = main.GAME_TILES_W, main.GAME_TILES_H
+    min_x = max(-MARGIN_BEFORE, bounds[0])
+    max_x = min(W - 1 + MARGIN_AFTER, bounds[1])
+    min_y = max(-MARGIN_BEFORE, bounds[2])
+    max_y = min(H - 1 + MARGIN_AFTER, bounds[3])
+    seen = set()
+    todo = [(x, y)]
+    while todo:
+        x, y = todo.pop()
+        if (x, y) in seen or not (min_x <= x <= max_x and min_y <= y <= max_y):
+            continue
+        if 0 <= x < W and 0 <= y < H and level_map[y, x] in walls:
+            continue
+        seen.add((x, y))
+        todo += [(x+1, y), (x-1, y), (x, y+1), (x, y-1)]
+    return seen
+
+
+def door_reachable(level_map, x, y, features):
+    """Whether the player on tile (x, y) could get to a door under
+    `features`.  Over-approximates where the player can go, so that
+    unreachable really means unreachable."""
+    W, H = main.GAME_TILES_W, main.GAME_TILES_H
+    if not features['player']:
+        return False
+
+    # Moving left, right or up needs a feature, apart from collisions
+    # pushing the player back by less than a tile
+    bounds = (-W if features['left'] else x - 1,
+              2*W if features['right'] else x + 1,
+              -H if features['jump'] or not features['gravity'] else y - 1,
+              2*H)
+    walls = {main.TILE_BLOCK, main.TILE_LOCK} if features['collisions'] else set()
+    while True:
+        seen = reachable_tiles(level_map, x, y, bounds, walls)
+        tiles = {level_map[ty, tx] for tx, ty in seen if 0 <= tx < W and 0 <= ty < H}
+        if main.TILE_DOOR in tiles:
+            return True
+        if main.TILE_LOCK not in walls or main.TILE_KEY not in tiles:
+            return False
+        # Picking up a key opens the locks
+        walls = walls - {main.TILE_LOCK}
+
+
+def check_invariants(app):
+    stack = app.scene_stack
+    scene = stack.top_scene()
+    if not isinstance(scene, main.LevelScene):
+        return None
+
+    if not (main.FIRST_LEVEL <= scene.level <= main.LAST_LEVEL):
+        return 'level {} out of range'.format(scene.level)
+
+    if len(set(main.sacrifices)) != len(main.sacrifices):
+        return 'duplicate sacrifices'
+
+    disabled = {name for name, state in main.features.items() if not state}
+    if disabled != set(main.sacrifices):
+        return 'disabled features do not match sacrifices'
+
+    pending = any(isinstance(menu, main.SacrificeMenu) for menu in stack.menus)
+    expected = scene.level - main.FIRST_LEVEL - (1 if pending else 0)
+    if len(main.sacrifices) != expected:
+        return 'wrong number of sacrifices for the level'
+
+    return None
+
+
+def check_softlock(app):
+    """A level whose door can't be reached with the features left: all the
+    player can do is restart it, over and over."""
+    stack = app.scene_stack
+    scene = stack.top_scene()
+    if not isinstance(scene, main.LevelScene) or stack.top_menu() is not None:
+        return None
+
+    level_map = app.backend.tilemap(0).data
+    px, py = int(scene.player.x + 4)//8, int(scene.player.y + 4)//8
+    if door_reachable(level_map, px, py, main.features):
+        return None
+    disabled = sorted(name for name, state in main.features.items() if not state)
+    return 'no reachable door on level {} without {}'.format(
+        scene.level, ', '.join(disabled) or 'any sacrifice')
+
+
+def coverage_key(app):
+    scene = app.scene_stack.top_scene()
+    menu = app.scene_stack.top_menu()
+    player = getattr(scene, 'player', None)
+    return (getattr(scene, 'level', None),
+            tuple(main.sacrifices),
+            type(menu).__name__ if menu is not None else None,
+            (int(player.x)//8, int(player.y)//8) if player is not None else None)
+
+
+def run(inputs):
+    """Play `inputs` from a fresh game.
+
+    Returns `(failure, frame, coverage)`, where failure is None or a
+    `(kind, detail)` signature and frame is where it happened."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        return _run(inputs)
+
+
+def _run(inputs):
+    app = _app
+    app.__init__(app.backend, *_start)
+    coverage = set()
+
+    for frame, keys in enumerate(inputs):
+        try:
+            app.step(keys)
+        except headless.Quit:
+            return None, frame, coverage
+        except Exception as e:
+            tb = traceback.extract_tb(e.__traceback__)[-1]
+            detail = '{}: {} at {}:{}'.format(
+                type(e).__name__, e, os.path.basename(tb.filename), tb.lineno)
+            return ('exception', detail), frame, coverage
+
+        violation = check_invariants(app)
+        if violation is not None:
+            return ('invariant', violation), frame, coverage
+
+        coverage.add(coverage_key(app))
+
+    softlock = check_softlock(app)
+    if softlock is not None:
+        return ('softlock', softlock), len(inputs) - 1, coverage
+
+    return None, len(inputs) - 1, coverage
+
+
+def random_bursts(rng, frames):
+    inputs = bytearray()
+    while len(inputs) < frames:
+        keys = rng.choices(COMBO_KEYS, COMBO_WEIGHTS)[0]
+        inputs.extend([keys] * rng.randint(1, 40))
+    return inputs[:frames]
+
+
+def mutate(rng, inputs, corpus):
+    inputs = bytearray(inputs)
+    for _ in range(rng.randint(1, 4)):
+        i = rng.randrange(len(inputs))
+        j = min(len(inputs), i + rng.randint(1, 120))
+        op = rng.randrange(5)
+        if op == 0:
+            inputs[i:j] = random_bursts(rng, j - i)
+        elif op == 1 and len(inputs) > j - i:
+            del inputs[i:j]
+        elif op == 2:
+            inputs[i:i] = inputs[i:j]
+        elif op == 3:
+            other = rng.choice(corpus)
+            k = rng.randrange(len(other))
+            inputs = inputs[:i] + other[k:]
+        else:
+            for k in range(i, j):
+                inputs[k] ^= 1 << rng.randrange(len(headless.KEYS))
+    return bytes(inputs)
+
+
+def minimize(args):
+    """Shrink a failing input while keeping the same failure signature."""
+    inputs, signature = args
+    _, frame, _ = run(inputs)
+    inputs = inputs[:frame+1]
+
+    def fails(candidate):
+        return len(candidate) > 0 and run(candidate)[0] == signature
+
+    # Drop runs of identical frames, in chunks of decreasing size
+    bursts = []
+    for keys in inputs:
+        if bursts and bursts[-1][0] == keys:
+            bursts[-1][1] += 1
+        else:
+            bursts.append([keys, 1])
+
+    def flatten(bursts):
+        return b''.join(bytes([keys]) * count for keys, count in bursts)
+
+    chunk = max(1, len(bursts) // 2)
+    while chunk >= 1:
+        i = 0
+        while i < len(bursts):
+            candidate = bursts[:i] + bursts[i+chunk:]
+            if fails(flatten(candidate)):
+                bursts = candidate
+            else:
+                i += chunk
+        chunk //= 2
+
+    # Then shorten each remaining run
+    for burst in bursts:
+        while burst[1] > 1:
+            count = burst[1]
+            burst[1] = count // 2
+            if not fails(flatten(bursts)):
+                burst[1] = count
+                break
+
+    return flatten(bursts), signature
+
+
+def save_repro(out_dir, inputs, signature, level, fixed_point):
+    kind, detail = signature
+    digest = hashlib.sha1(detail.encode()).hexdigest()[:8]
+    filename = os.path.join(out_dir, '{}-{}.txt'.format(kind, digest))
+    headless.save_inputs(filename, inputs, [
+        kind, detail,
+        'level: {}'.format(level),
+        'fixed_point: {}'.format(fixed_point),
+    ])
+    return filename
+
+
+def load_repro_options(filename):
+    """The level and fixed_point a repro file was found with, from its
+    header."""
+    header = headless.load_header(filename)
+    return (int(header.get('level', main.FIRST_LEVEL)),
+            header.get('fixed_point') == 'True')
+
+
+def replay(filename, level=None, fixed_point=None):
+    """Replay a repro file, with the options from its header unless given."""
+    saved_level, saved_fixed_point = load_repro_options(filename)
+    if level is None:
+        level = saved_level
+    if fixed_point is None:
+        fixed_point = saved_fixed_point
+
+    _init_worker(level, fixed_point)
+    inputs = headless.load_inputs(filename)
+    failure, frame, _ = run(inputs)
+    if failure is None:
+        print("No failure in {} frames".format(len(inputs)))
+    else:
+        print("{} at frame {}: {}".format(failure[0], frame, failure[1]))
+
+
+def fuzz(runs, frames, workers, seed, level, fixed_point, out_dir):
+    rng = random.Random(seed)
+    corpus = []
+    coverage = set()
+    failures = {}
+
+    pool = multiprocessing.Pool(workers, _init_worker, (level, fixed_point))
+    done = 0
+    start = time.perf_counter()
+    total_frames = 0
+
+    while done < runs:
+        batch = []
+        for _ in range(min(workers * 16, runs - done)):
+            if corpus and rng.random() < 0.7:
+                batch.append(mutate(rng, rng.choice(corpus), corpus))
+            else:
+                batch.append(bytes(random_bursts(rng, frames)))
+
+        for inputs, (failure, frame, cov) in zip(batch, pool.imap(run, batch, 4)):
+            total_frames += frame + 1
+            if failure is not None:
+                if failure not in failures:
+                    print("New failure: {} {}".format(*failure))
+                    failures[failure] = inputs
+            elif not cov <= coverage:
+                coverage |= cov
+                corpus.append(inputs)
+
+        done += len(batch)
+
+    elapsed = time.perf_counter() - start
+    print("{} runs, {} frames in {:.1f}s: {:.1f} runs/s/core, {:.0f} frames/s/core".format(
+        done, total_frames, elapsed,
+        done / elapsed / workers, total_frames / elapsed / workers))
+    print("{} states covered, {} unique failures".format(len(coverage), len(failures)))
+
+    if failures:
+        os.makedirs(out_dir, exist_ok=True)
+        jobs = [(inputs, failure) for failure, inputs in failures.items()]
+        for inputs, signature in pool.imap_unordered(minimize, jobs):
+            filename = save_repro(out_dir, inputs, signature, level, fixed_point)
+            print("{} ({} frames)".format(filename, len(inputs)))
+
+    pool.close()
+    pool.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--runs', type=int, default=2000)
+    parser.add_argument('--frames', type=int, default=3000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--level', type=int,
+                        help="level to start from, the first one by default, or "
+                             "the one in the --replay file")
+    parser.add_argument('--fixed-point', action='store_true', default=None,
+                        help="use the integer physics")
+    parser.add_argument('--out', default=FUZZ_OUT)
+    parser.add_argument('--replay', metavar='FILE')
+    args = parser.parse_args()
+
+    if args.replay:
+        replay(args.replay, args.level, args.fixed_point)
+    else:
+        fuzz(args.runs, args.frames, args.workers, args.seed,
+             main.FIRST_LEVEL if args.level is None else args.level,
+             bool(args.fixed_point), args.out)
@@ -0,0 +1,284 @@
+"""Run the game without a window.
+
+HeadlessPyxel implements the part of the pyxel API that main.py uses, with
+input coming from a scripted stream instead of the keyboard.  Each frame of
+input is an int bitmask over KEYS.
+"""
+import gzip
+import pickle
+
+import main
+
+
+KEYS = ('UP', 'DOWN', 'LEFT', 'RIGHT', 'ENTER', 'TAB')
+
+INITIAL_FEATURES = dict(main.features)
+
+
+class Quit(Exception):
+    """pyxel.quit() was called"""
+
+
+class _Opaque:
+    """stands in for pyxel's Sound and Music objects in resource files"""
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __setstate__(self, state):
+        pass
+
+
+class _ResourceUnpickler(pickle.Unpickler):
+    def find_class(self, module, name):
+        if module.startswith('pyxel'):
+            return _Opaque
+        return super().find_class(module, name)
+
+
+def load_resource(filename):
+    with gzip.open(filename) as f:
+        data = _ResourceUnpickler(f).load()
+
+    images = [pickle.loads(image) for image in data['image']]
+    tilemaps = [(pickle.loads(tilemap), refimg)
+                for tilemap, refimg in data['tilemap']]
+    return images, tilemaps
+
+
+class Image:
+    def __init__(self, data):
+        self.data = data
+
+
+class Tilemap:
+    def __init__(self, backend, data, refimg):
+        self.backend = backend
+        self.data = data
+        self.refimg = refimg
+
+    def get(self, x, y):
+        # An int like pyxel's, a numpy scalar would be allocated
+        return self.data.item(y, x)
+
+    def set(self, x, y, data):
+        self.data[y, x] = data
+
+    def copy(self, x, y, tm, sx, sy, w, h):
+        src = self.backend.tilemap(tm).data
+        self.data[y:y+h, x:x+w] = src[sy:sy+h, sx:sx+w]
+
+
+class HeadlessPyxel:
+    KEY_UP = 0
+    KEY_DOWN = 1
+    KEY_LEFT = 2
+    KEY_RIGHT = 3
+    KEY_ENTER = 4
+    KEY_TAB = 5
+
+    def __init__(self, filename='resource.pyxel', resource=None):
+        if resource is None:
+            resource = load_resource(filename)
+        images, tilemaps = resource
+
+        # The game only ever writes to tilemap 0 and to the window tilemap,
+        # so everything else can be shared between backends loaded from the
+        # same resource
+        for data in images:
+            data.flags.writeable = False
+        for data, _ in tilemaps:
+            data.flags.writeable = False
+
+        self.images = [Image(data) for data in images]
+        self.pristine = tilemaps[0]
+        self.tilemaps = [Tilemap(self, data, refimg) for data, refimg in tilemaps]
+        self.tilemaps[0].data = self.pristine[0].copy()
+        self.tilemaps[main.WINDOW_TM].data = tilemaps[main.WINDOW_TM][0].copy()
+        # The windows laid out in that copy, see main.window_slot
+        self.window_slots = {}
+
+        # main.py calls these as functions of the pyxel module, which makes
+        # a new bound method on every call when pyxel is this object
+        for name in ('btn', 'btnp', 'btnr', 'tilemap', 'image',
+                     'cls', 'blt', 'bltm', 'text'):
+            setattr(self, name, getattr(self, name))
+
+        self.reset()
+
+    def reset(self):
+        tm = self.tilemaps[0]
+        tm.data[:] = self.pristine[0]
+        tm.refimg = self.pristine[1]
+
+        self.frame_count = 0
+        self.keys = 0
+        # Same bookkeeping as pyxel: frame of the last press, or minus the
+        # frame of the last release
+        self.key_state = [0] * len(KEYS)
+        self.pressed = [False] * len(KEYS)
+        self.released = [False] * len(KEYS)
+        self.held_for = [-1] * len(KEYS)
+
+    def set_input(self, keys):
+        self.frame_count += 1
+        changed = keys ^ self.keys
+        for key in range(len(KEYS)):
+            if changed & (1 << key):
+                if keys & (1 << key):
+                    self.key_state[key] = self.frame_count
+                else:
+                    self.key_state[key] = -self.frame_count
+        self.keys = keys
+
+        # Worked out here rather than in btnp and btnr, so that the frame
+        # itself doesn't allocate (see allocprof.py)
+        for key, state in enumerate(self.key_state):
+            self.pressed[key] = state == self.frame_count
+            self.released[key] = state == -self.frame_count
+            self.held_for[key] = self.frame_count - state if state > 0 else -1
+
+    def btn(self, key):
+        return bool(self.keys & (1 << key))
+
+    def btnp(self, key, hold=0, period=0):
+        if self.pressed[key]:
+            return True
+
+        held = self.held_for[key]
+        return period > 0 and held >= hold and (held - hold) % period == 0
+
+    def btnr(self, key):
+        return self.released[key]
+
+    def tilemap(self, tm):
+        return self.tilemaps[tm]
+
+    def image(self, img):
+        return self.images[img]
+
+    def quit(self):
+        raise Quit()
+
+    def cls(self, col):
+        pass
+
+    def blt(self, x, y, img, sx, sy, w, h, colkey=None):
+        pass
+
+    def bltm(self, x, y, tm, sx, sy, w, h, colkey=None):
+        pass
+
+    def text(self, x, y, s, col):
+        pass
+
+
+class HeadlessApp(main.App):
+    """A game with its own tilemap, features and sacrifices.
+
+    main.py keeps that state in module globals, so step() points them to
+    this game's before running a frame."""
+    def __init__(self, backend, level=0, sacrifices=(), fixed_point=False):
+        self.backend = backend
+        self.fixed_point = fixed_point
+        backend.reset()
+
+        self.features = dict(INITIAL_FEATURES)
+        self.sacrifices = []
+        self.last_sacrifice = ''
+        self.tilemap_origin = [0, 0]
+        for feature in sacrifices:
+            self.features[feature] = False
+            self.sacrifices.append(feature)
+
+        self.activate()
+        self.scene_stack = main.SceneStack()
+        self.scene_stack.push_scene(main.new_level_scene(level))
+
+        self.idle = False
+        self.idle_menu = None
+
+    def activate(self):
+        main.pyxel = self.backend
+        main.features = self.features
+        main.sacrifices = self.sacrifices
+        main.last_sacrifice = self.last_sacrifice
+        main.fixed_point = self.fixed_point
+        main.tilemap_origin = self.tilemap_origin
+        main.window_slots = self.backend.window_slots
+
+    def step(self, keys):
+        self.activate()
+        self.backend.set_input(keys)
+        self.update()
+        self.draw()
+
+
+def save_levels(filename, column, levels):
+    """Copy 16x16 levels into tilemap 1 of a resource file, one per column
+    from `column` on.  Unlike load_resource, this needs pyxel's Sound and
+    Music classes to round-trip the rest of the file."""
+    with gzip.open(filename) as f:
+        data = pickle.load(f)
+
+    tilemap, refimg = data['tilemap'][1]
+    tilemap = pickle.loads(tilemap)
+    W, H = main.GAME_TILES_W, main.GAME_TILES_H
+    for i, level in enumerate(levels):
+        tilemap[:H, (column+i)*W:(column+i+1)*W] = level
+    data['tilemap'][1] = (pickle.dumps(tilemap, 2), refimg)
+
+    with gzip.open(filename, 'wb') as f:
+        pickle.dump(data, f, 3)
+
+
+def encode_keys(keys):
+    names = [name for i, name in enumerate(KEYS) if keys & (1 << i)]
+    return ' '.join(names) if names else '-'
+
+
+def decode_keys(text):
+    keys = 0
+    for name in text.split():
+        if name != '-':
+            keys |= 1 << KEYS.index(name)
+    return keys
+
+
+def save_inputs(filename, inputs, comments=()):
+    """Write one line per run of identical frames: `<count> <keys...>`."""
+    with open(filename, 'w') as f:
+        for comment in comments:
+            f.write('# {}\n'.format(comment))
+
+        i = 0
+        while i < len(inputs):
+            j = i
+            while j < len(inputs) and inputs[j] == inputs[i]:
+                j += 1
+            f.write('{} {}\n'.format(j - i, encode_keys(inputs[i])))
+            i = j
+
+
+def load_header(filename):
+    """The `name: value` comments at the top of an input file."""
+    header = {}
+    with open(filename) as f:
+        for line in f:
+            if not line.startswith('#'):
+                break
+            name, _, value = line[1:].strip().partition(': ')
+            if value:
+                header[name] = value
+    return header
+
+
+def load_inputs(filename):
+    inputs = bytearray()
+    with open(filename) as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if not line:
+                continue
+            count, _, keys = line.partition(' ')
+            inputs.extend([decode_keys(keys)] * int(count))
+    return bytes(inputs)
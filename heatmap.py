@@ -0,0 +1,209 @@
+"""Per-level heatmaps of where players go, die and restart.
+
+Record sessions by playing with:
+
+    python heatmap.py --record sessions [--fixed-point]
+
+then replay any number of them headless, in parallel, into count grids:
+
+    python heatmap.py sessions/*.txt --out heatmap.npz
+
+and look at one of the grids over the levels (H toggles it):
+
+    python heatmap.py --show heatmap.npz --layer deaths
+"""
+import argparse
+import atexit
+import contextlib
+import multiprocessing
+import os
+import time
+
+import numpy as np
+import pyxel
+
+import headless
+import main
+import telemetry
+
+
+LAYERS = ('occupancy', 'deaths', 'restarts')
+OCCUPANCY, DEATHS, RESTARTS = range(len(LAYERS))
+LEVELS = main.LAST_LEVEL + 1
+H, W = main.GAME_TILES_H, main.GAME_TILES_W
+
+# The overlay is drawn from a tilemap and tiles the game doesn't use
+HEAT_TM = 7
+HEAT_IMG = 2
+HEAT_TILE = 31 * 32
+HEAT_COLORS = (1, 2, 8, 9, 10)
+
+
+class Collector:
+    """Takes the place of the telemetry event log to count deaths and
+    restarts where they happen."""
+    def __init__(self, grids):
+        self.deaths = grids[DEATHS].reshape(-1)
+        self.restarts = grids[RESTARTS].reshape(-1)
+        self.app = None
+        self.last = -1
+
+    def log(self, frame, event, level, arg=0):
+        if event == telemetry.DEATH and self.last >= 0:
+            # The player is already out of the level, use where it was last
+            self.deaths[self.last] += 1
+        elif event == telemetry.RESTART:
+            cell = player_cell(self.app)
+            if cell >= 0:
+                self.restarts[cell] += 1
+
+
+def player_cell(app):
+    """Flat index in a (LEVELS, H, W) grid of the tile under the player, or
+    -1 when there is none."""
+    scene = app.scene_stack.top_scene()
+    if not isinstance(scene, main.LevelScene):
+        return -1
+
+    player = scene.player
+    x = int(player.x + player.w/2) // 8
+    y = int(player.y + player.h/2) // 8
+    if not (0 <= x < W and 0 <= y < H):
+        return -1
+    return (scene.level * H + y) * W + x
+
+
+def accumulate(filenames):
+    grids = np.zeros((len(LAYERS), LEVELS, H, W), np.int64)
+    occupancy = grids[OCCUPANCY].reshape(-1)
+
+    backend = headless.HeadlessPyxel()
+    collector = Collector(grids)
+    main.event_log = collector
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for filename in filenames:
+            # Replayed with the physics they were played with
+            fixed_point = headless.load_header(filename).get('fixed_point') == 'True'
+            app = headless.HeadlessApp(backend, fixed_point=fixed_point)
+            collector.app = app
+            collector.last = -1
+
+            for keys in headless.load_inputs(filename):
+                try:
+                    app.step(keys)
+                except headless.Quit:
+                    break
+                except Exception:
+                    break  # that's for fuzz.py to look into
+
+                cell = player_cell(app)
+                if cell >= 0:
+                    collector.last = cell
+                    if app.scene_stack.top_menu() is None:
+                        occupancy[cell] += 1
+
+    return grids
+
+
+def aggregate(filenames, workers, files_per_task=16):
+    tasks = [filenames[i:i+files_per_task]
+             for i in range(0, len(filenames), files_per_task)]
+    grids = np.zeros((len(LAYERS), LEVELS, H, W), np.int64)
+    with multiprocessing.Pool(workers) as pool:
+        for partial in pool.imap_unordered(accumulate, tasks):
+            grids += partial
+    return grids
+
+
+def heat_levels(grid, steps=len(HEAT_COLORS)):
+    """Quantize counts to 0..steps, on a log scale, level by level."""
+    top = grid.max(axis=(1, 2), keepdims=True)
+    heat = np.log1p(grid) / np.log1p(np.maximum(top, 1)) * steps
+    return np.ceil(heat).astype(np.uint16)
+
+
+class HeatmapApp(main.App):
+    def __init__(self, grid):
+        self.heat = heat_levels(grid)
+        self.visible = True
+        self.ready = False
+        super().__init__()
+
+    def install(self):
+        # Checkered tiles, so that the level shows through
+        img = pyxel.image(HEAT_IMG).data
+        row, col = divmod(HEAT_TILE, 32)
+        pattern = (np.indices((8, 8)).sum(axis=0) % 2) == 0
+        for i, color in enumerate((0,) + HEAT_COLORS):
+            tile = img[row*8:(row+1)*8, (col+i)*8:(col+i+1)*8]
+            tile[:] = np.where(pattern, color, 0)
+
+        tm = pyxel.tilemap(HEAT_TM)
+        tm.refimg = HEAT_IMG
+        for level in range(LEVELS):
+            tm.data[:H, level*W:(level+1)*W] = HEAT_TILE + self.heat[level]
+
+        self.ready = True
+
+    def update(self):
+        if pyxel.btnp(pyxel.KEY_H):
+            self.visible = not self.visible
+        super().update()
+
+    def draw(self):
+        if not self.ready:
+            self.install()
+
+        super().draw()
+
+        scene = self.scene_stack.top_scene()
+        if (self.visible and isinstance(scene, main.LevelScene)
+                and self.scene_stack.top_menu() is None):
+            pyxel.bltm(0, 0, HEAT_TM, scene.level * W, 0, W, H, colkey=0)
+
+
+class RecordingApp(main.App):
+    def __init__(self, directory):
+        self.inputs = bytearray()
+        self.keys = [getattr(pyxel, 'KEY_' + name) for name in headless.KEYS]
+        filename = os.path.join(directory, time.strftime('%Y%m%d-%H%M%S.txt'))
+        atexit.register(lambda: headless.save_inputs(
+            filename, self.inputs, ['fixed_point: {}'.format(main.fixed_point)]))
+        super().__init__()
+
+    def update(self):
+        keys = 0
+        for i, key in enumerate(self.keys):
+            if pyxel.btn(key):
+                keys |= 1 << i
+        self.inputs.append(keys)
+        super().update()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Player position heatmaps")
+    parser.add_argument('sessions', nargs='*', help="recorded inputs")
+    parser.add_argument('--out', default='heatmap.npz')
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--record', metavar='DIR',
+                        help="play the game and record inputs into DIR")
+    parser.add_argument('--show', metavar='FILE',
+                        help="play the game over the heatmaps in FILE")
+    parser.add_argument('--layer', choices=LAYERS, default='occupancy')
+    parser.add_argument('--fixed-point', action='store_true',
+                        help="play with the integer physics")
+    args = parser.parse_args()
+    main.fixed_point = args.fixed_point
+
+    if args.record:
+        os.makedirs(args.record, exist_ok=True)
+        RecordingApp(args.record)
+    elif args.show:
+        HeatmapApp(np.load(args.show)[args.layer])
+    else:
+        start = time.perf_counter()
+        grids = aggregate(args.sessions, args.workers)
+        np.savez(args.out, **dict(zip(LAYERS, grids)))
+        print("{} sessions in {:.1f}s, saved {}".format(
+            len(args.sessions), time.perf_counter() - start, args.out))
@@ -0,0 +1,204 @@
+"""Host many headless games in one process.
+
+Sessions are ticked round-robin at 60 Hz each from an asyncio loop, and are
+driven through a local socket speaking one JSON object per line:
+
+    {"cmd": "create", "level": 0, "fixed_point": false} -> {"session": 1}
+    {"cmd": "input", "session": 1, "keys": ["RIGHT", "UP"]}
+    {"cmd": "state", "session": 1}          -> level, menus, player, ...
+    {"cmd": "frame", "session": 1}          -> the visible tiles and player
+    {"cmd": "close", "session": 1}
+    {"cmd": "stats"}                        -> CPU time of every session
+
+Keys given with "input" stay held until the next "input".  Frames are
+returned as tiles rather than pixels, since nothing is rasterized headless.
+
+    python host.py --socket host.sock
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import time
+
+import headless
+import main
+
+
+class Session:
+    def __init__(self, session_id, resource, level=0, fixed_point=False):
+        self.id = session_id
+        self.app = headless.HeadlessApp(
+            headless.HeadlessPyxel(resource=resource), level,
+            fixed_point=fixed_point)
+        self.keys = 0
+        self.status = 'running'
+        self.error = None
+        self.frames = 0
+        self.cpu_time = 0
+
+    def tick(self):
+        start = time.thread_time_ns()
+        try:
+            self.app.step(self.keys)
+        except headless.Quit:
+            self.status = 'quit'
+        except Exception as e:
+            self.status = 'error'
+            self.error = '{}: {}'.format(type(e).__name__, e)
+        self.cpu_time += time.thread_time_ns() - start
+        self.frames += 1
+
+    def state(self):
+        stack = self.app.scene_stack
+        scene = stack.top_scene()
+        player = getattr(scene, 'player', None)
+        return {
+            'session': self.id,
+            'status': self.status,
+            'error': self.error,
+            'frame': self.frames,
+            'level': getattr(scene, 'level', None),
+            'scene': type(scene).__name__ if scene is not None else None,
+            'menus': [type(menu).__name__ for menu in stack.menus],
+            'player': [player.x, player.y] if player is not None else None,
+            'sacrifices': list(self.app.sacrifices),
+            'cpu_ms': self.cpu_time / 1e6,
+        }
+
+    def frame(self):
+        tiles = self.app.backend.tilemap(0).data[:main.GAME_TILES_H, :main.GAME_TILES_W]
+        state = self.state()
+        state['tiles'] = tiles.tolist()
+        return state
+
+
+class Host:
+    def __init__(self, resource_file='resource.pyxel'):
+        self.resource = headless.load_resource(resource_file)
+        self.sessions = {}
+        self.next_id = 1
+        self.ticks = 0
+        self.late = 0
+
+    def create(self, level=0, fixed_point=False):
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            session = Session(self.next_id, self.resource, level, fixed_point)
+        self.sessions[session.id] = session
+        self.next_id += 1
+        return session
+
+    def tick(self):
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            for session in self.sessions.values():
+                if session.status == 'running':
+                    session.tick()
+        self.ticks += 1
+
+    async def run(self, fps=main.FPS):
+        loop = asyncio.get_running_loop()
+        period = 1 / fps
+        deadline = loop.time()
+        while True:
+            self.tick()
+            deadline += period
+            delay = deadline - loop.time()
+            if delay < -1:
+                # Too far behind to catch up, drop the missed ticks
+                deadline = loop.time()
+            if delay < 0:
+                self.late += 1
+            await asyncio.sleep(max(0, delay))
+
+    def stats(self):
+        return {
+            'ticks': self.ticks,
+            'late_ticks': self.late,
+            'sessions': {
+                session.id: {
+                    'status': session.status,
+                    'frames': session.frames,
+                    'cpu_ms': session.cpu_time / 1e6,
+                }
+                for session in self.sessions.values()
+            },
+        }
+
+    def handle(self, request):
+        cmd = request.get('cmd')
+        if cmd == 'create':
+            session = self.create(request.get('level', 0),
+                                  request.get('fixed_point', False))
+            return {'session': session.id}
+        if cmd == 'stats':
+            return self.stats()
+
+        session = self.sessions.get(request.get('session'))
+        if session is None:
+            return {'error': 'no such session'}
+
+        if cmd == 'input':
+            session.keys = headless.decode_keys(' '.join(request.get('keys', [])))
+            return {'ok': True}
+        elif cmd == 'state':
+            return session.state()
+        elif cmd == 'frame':
+            return session.frame()
+        elif cmd == 'close':
+            del self.sessions[session.id]
+            return {'ok': True}
+        return {'error': 'unknown command {}'.format(cmd)}
+
+    async def serve_client(self, reader, writer):
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                response = self.handle(json.loads(line))
+            except (ValueError, TypeError, KeyError, main.GameError) as e:
+                response = {'error': str(e)}
+            writer.write(json.dumps(response).encode() + b'\n')
+            await writer.drain()
+        writer.close()
+
+
+def benchmark(host, sessions, seconds):
+    for _ in range(sessions):
+        host.create()
+    start = time.process_time()
+    ticks = 0
+    while time.process_time() - start < seconds:
+        host.tick()
+        ticks += 1
+    elapsed = time.process_time() - start
+    frames = ticks * sessions
+    print("{} frames in {:.1f}s CPU: {:.0f} frames/s, {:.0f} sessions at {} Hz per core".format(
+        frames, elapsed, frames / elapsed, frames / elapsed / main.FPS, main.FPS))
+
+
+async def serve(host, path, sessions):
+    for _ in range(sessions):
+        host.create()
+    server = await asyncio.start_unix_server(host.serve_client, path)
+    async with server:
+        await host.run()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Host many headless games")
+    parser.add_argument('--socket', default='host.sock')
+    parser.add_argument('--sessions', type=int, default=0,
+                        help="sessions to create at startup")
+    parser.add_argument('--benchmark', type=float, metavar='SECONDS',
+                        help="tick --sessions idle sessions as fast as possible")
+    args = parser.parse_args()
+
+    host = Host()
+    if args.benchmark:
+        benchmark(host, args.sessions, args.benchmark)
+    else:
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        asyncio.run(serve(host, args.socket, args.sessions))
@@ -0,0 +1,153 @@
+"""Play the game with resource.pyxel hot reloading.
+
+A watcher thread polls the resource file, and when it changes, loads it and
+diffs it against what was loaded last.  Changed image banks and changed
+tilemap columns the game only reads from (the levels of tilemap 1 and the
+bad ending in tilemap 0) are then copied in at the start of the next frame;
+the rest of the tilemaps are laid out while playing and are left alone.  If
+the scene on screen comes from a column that changed, it is reloaded in
+place, keeping the features and sacrifices as they are.
+
+    python hotreload.py [--fixed-point]
+"""
+import argparse
+import os
+import threading
+
+import numpy as np
+import pyxel
+
+import headless
+import main
+
+
+RESOURCE_FILE = 'resource.pyxel'
+
+
+def is_source(tm, column):
+    """Whether the game only reads from that tilemap column.  The other
+    columns of tilemap 0 hold the level being played, and tilemaps 6 and 7
+    windows and heatmaps."""
+    return tm == 1 or (tm == 0 and column == main.BAD_ENDGAME_COLUMN)
+
+
+def diff_resource(old, new):
+    """List what changed from one loaded resource to the other, as
+    `('image', img, None, data)` and `('tilemap', tm, column, data)`, for
+    source tilemap columns only."""
+    old_images, old_tilemaps = old
+    new_images, new_tilemaps = new
+    changes = []
+
+    for img, (a, b) in enumerate(zip(old_images, new_images)):
+        if not np.array_equal(a, b):
+            changes.append(('image', img, None, b))
+
+    W = main.GAME_TILES_W
+    for tm, ((a, _), (b, _)) in enumerate(zip(old_tilemaps, new_tilemaps)):
+        height, width = a.shape
+        differ = (a != b).reshape(height, width // W, W).any(axis=(0, 2))
+        for column in map(int, np.nonzero(differ)[0]):
+            if is_source(tm, column):
+                changes.append(('tilemap', tm, column, b[:, column*W:(column+1)*W]))
+
+    return changes
+
+
+class ResourceWatcher:
+    def __init__(self, filename, interval=0.25):
+        self.filename = filename
+        self.interval = interval
+        self.mtime = os.stat(filename).st_mtime
+        self.loaded = headless.load_resource(filename)
+
+        self.lock = threading.Lock()
+        self.pending = []
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                mtime = os.stat(self.filename).st_mtime
+                if mtime == self.mtime:
+                    continue
+                resource = headless.load_resource(self.filename)
+            except (OSError, EOFError, ValueError):
+                continue  # the editor is still writing the file
+
+            self.mtime = mtime
+            changes = diff_resource(self.loaded, resource)
+            self.loaded = resource
+            if changes:
+                with self.lock:
+                    self.pending += changes
+
+    def take_changes(self):
+        with self.lock:
+            changes, self.pending = self.pending, []
+        return changes
+
+    def stop(self):
+        self.stopped.set()
+
+
+def apply_changes(changes):
+    """Copy the changes in; return the (tm, column) that changed."""
+    W = main.GAME_TILES_W
+    columns = set()
+    for kind, index, column, data in changes:
+        if kind == 'image':
+            pyxel.image(index).data[:] = data
+        else:
+            pyxel.tilemap(index).data[:, column*W:(column+1)*W] = data
+            columns.add((index, column))
+    return columns
+
+
+def reload_level(scene_stack):
+    """Replace the current level scene by a fresh one, without asking for
+    a sacrifice or showing the help text again."""
+    scene = scene_stack.top_scene()
+    menus = len(scene_stack.menus)
+
+    new_scene = main.new_level_scene(scene.level)
+    new_scene.dialog = scene.dialog
+    new_scene.entered = scene.entered
+    new_scene.scene_stack = scene_stack
+    new_scene.load()
+    scene_stack.scenes[-1] = new_scene
+
+    del scene_stack.menus[menus:]
+
+
+class DevApp(main.App):
+    def __init__(self):
+        self.watcher = ResourceWatcher(RESOURCE_FILE)
+        super().__init__()
+
+    def update(self):
+        changes = self.watcher.take_changes()
+        if changes:
+            columns = apply_changes(changes)
+            scene = self.scene_stack.top_scene()
+            if isinstance(scene, main.LevelScene) and (1, scene.level) in columns:
+                reload_level(self.scene_stack)
+            elif (isinstance(scene, main.BadEndgameScene)
+                    and (0, main.BAD_ENDGAME_COLUMN) in columns):
+                scene.load()
+            self.idle_menu = None  # draw the changes even if idle
+            print("Reloaded", ', '.join(
+                '{} {}{}'.format(kind, index, '' if column is None else ':{}'.format(column))
+                for kind, index, column, _ in changes))
+
+        super().update()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Play with resource hot reloading")
+    parser.add_argument('--fixed-point', action='store_true', help="use the integer physics")
+    args = parser.parse_args()
+    main.fixed_point = args.fixed_point
+    DevApp()
@@ -0,0 +1,426 @@
+"""Procedural level generator.
+
+Levels are generated in numpy batches and kept only if the door can be
+reached under a given set of features, e.g. without jumping:
+
+    python levelgen.py --count 1000 --without jump --out pack.npy
+
+Packs are saved in the tilemap 1 layout that LevelScene.load reads, one
+16x16 column per level.  --resource also copies the first levels of the pack
+into the level columns of a resource file, starting at --column.  By default
+that's the free columns after the game's last level, which the game plays
+with e.g.:
+
+    python main.py --level 11 --last-level 15
+
+Candidates first go through a tile-level model of the movement rules of
+Player.update, run on the whole batch at once:
+
+- with gravity, the player walks on ground, falls (drifting one tile
+  sideways per tile fallen), and jumps two tiles up and one across, or
+  one tile up and two across;
+- without gravity, the player pushes against a wall and slides in a straight
+  line until it hits another wall or friction stops it.
+
+The model is generous, so it only rejects the hopeless levels.  Those left
+are then played by batches of players with random inputs and the physics of
+fixedpoint, and a level is only kept if one of them gets to the door, and
+main.Player, the float physics the game plays with by default, gets there
+too with the same keys: every accepted level has been solved at least once
+with both physics.
+
+Picking up a key unlocks every lock, as in the game.
+"""
+import argparse
+import time
+
+import numpy as np
+
+import fixedpoint
+import headless
+import main
+
+
+H, W = main.GAME_TILES_H, main.GAME_TILES_W
+TILEMAP_COLUMNS = 256 // W
+
+# How far a push carries the player when gravity is gone but friction isn't
+SLIDE_TILES = int(main.PLAYER_SPEED**2 / (2 * main.FRICTION_AIR)) // 8
+
+KEY = {name: 1 << i for i, name in enumerate(headless.KEYS)}
+# Keys held by the players of the search, which change every CHANGE_FRAMES
+# frames on average
+MOVES = np.array([0, KEY['LEFT'], KEY['RIGHT'], KEY['UP'], KEY['DOWN'],
+                  KEY['LEFT'] | KEY['UP'], KEY['RIGHT'] | KEY['UP'],
+                  KEY['LEFT'] | KEY['DOWN'], KEY['RIGHT'] | KEY['DOWN']])
+CHANGE_FRAMES = 12
+
+
+def shift(a, dy, dx, fill=False):
+    """Move the contents of a batch of grids by (dy, dx) tiles."""
+    out = np.full_like(a, fill)
+    ys = slice(max(dy, 0), H + min(dy, 0))
+    yd = slice(max(-dy, 0), H + min(-dy, 0))
+    xs = slice(max(dx, 0), W + min(dx, 0))
+    xd = slice(max(-dx, 0), W + min(-dx, 0))
+    out[:, ys, xs] = a[:, yd, xd]
+    return out
+
+
+def prepare(levels, features):
+    """Erase keys and locks the way LevelScene.load does."""
+    levels = levels.copy()
+    if not features['keys']:
+        levels[levels == main.TILE_KEY] = 0
+    if not features['locks']:
+        levels[levels == main.TILE_LOCK] = 0
+    return levels
+
+
+def solvable(levels, features, rng=None, tries=64, frames=900):
+    """For each level of the batch, whether a player was seen reaching the
+    door."""
+    ok = reachable(levels, features)
+    ok[ok] = search(levels[ok], features, rng, tries, frames)
+    return ok
+
+
+def reachable(levels, features):
+    """For each level of the batch, whether the tile model reaches the door."""
+    levels = prepare(levels, features)
+    B = len(levels)
+    if not features['player']:
+        return np.zeros(B, bool)
+
+    blocks = levels == main.TILE_BLOCK
+    locks = levels == main.TILE_LOCK
+    keys = levels == main.TILE_KEY
+    doors = levels == main.TILE_DOOR
+
+    # Cells the player rests at, and cells it passes through
+    reached = levels == main.TILE_PLAYER
+    touched = reached.copy()
+    unlocked = np.zeros(B, bool)
+
+    while True:
+        if features['collisions']:
+            wall = blocks | (locks & ~unlocked[:, None, None])
+        else:
+            wall = np.zeros_like(blocks)
+        free = ~wall
+
+        if features['gravity']:
+            new = gravity_moves(reached, wall, free, features)
+            new_touched = new
+        else:
+            # Pushing also works while sliding past a wall
+            new, new_touched = slide_moves(touched, wall, free, features)
+
+        new |= reached
+        new_touched |= touched | new
+        new_unlocked = unlocked | (new_touched & keys).any(axis=(1, 2))
+
+        if (np.array_equal(new, reached) and np.array_equal(new_touched, touched)
+                and np.array_equal(new_unlocked, unlocked)):
+            break
+        reached, touched, unlocked = new, new_touched, new_unlocked
+
+    return (touched & doors).any(axis=(1, 2))
+
+
+def gravity_moves(reached, wall, free, features):
+    ground = shift(wall, -1, 0)
+    # The player is 8 pixels wide, so it can stand with most of itself past
+    # the edge of a platform, and drop off it too
+    ledge = ground | shift(ground, 0, 1) | shift(ground, 0, -1)
+    standing = reached & ledge
+    falling = reached & ~ground
+    sides = [dx for dx, name in ((1, 'right'), (-1, 'left')) if features[name]]
+
+    new = np.zeros_like(reached)
+    for dx in sides:
+        new |= shift(standing, 0, dx) & free
+
+    down = shift(falling, 1, 0) & free
+    new |= down
+    for dx in sides:
+        new |= shift(down, 0, dx) & free
+
+    if features['jump']:
+        # A jump rises just under two tiles, which is enough to get over
+        # the edge of a platform two tiles up
+        up1 = shift(standing, -1, 0) & free
+        up2 = shift(up1, -1, 0) & free
+        new |= up1 | up2
+        for dx in sides:
+            new |= shift(up2, 0, dx) & free
+            across = up1
+            for _ in range(2):
+                across = shift(across, 0, dx) & free
+                new |= across
+
+    return new
+
+
+def slide_moves(reached, wall, free, features):
+    # (direction, the wall to push against, the feature it needs)
+    pushes = [((0, 1), (0, -1), 'right'), ((0, -1), (0, 1), 'left'),
+              ((1, 0), (-1, 0), None), ((-1, 0), (1, 0), None)]
+    limit = SLIDE_TILES if features['friction'] else max(H, W)
+
+    rest = np.zeros_like(reached)
+    touched = np.zeros_like(reached)
+    for (dy, dx), (wy, wx), feature in pushes:
+        if feature is not None and not features[feature]:
+            continue
+
+        # Outside of the level counts as free: sliding out restarts it
+        ahead_free = shift(free, -dy, -dx, fill=True)
+        cur = reached & shift(wall, -wy, -wx)
+        for _ in range(limit):
+            rest |= cur & ~ahead_free
+            cur = shift(cur, dy, dx) & free
+            touched |= cur
+        rest |= cur
+
+    return rest, touched
+
+
+def search(levels, features, rng=None, tries=64, frames=900):
+    """For each level of the batch, whether one of `tries` players holding
+    random keys reaches the door within `frames` frames.
+
+    Players leaving the level start it over, like in LevelScene.update.  A
+    player reaching the door only solves the level if the game's Player
+    does too with the same keys, see replay()."""
+    rng = np.random.default_rng(rng)
+    B = len(levels)
+    solved = np.zeros(B, bool)
+    if B == 0 or not features['player']:
+        return solved
+
+    start = prepare(levels, features)
+    sy, sx = np.divmod((start.reshape(B, -1) == main.TILE_PLAYER).argmax(axis=1), W)
+    start[start == main.TILE_PLAYER] = 0
+
+    level = np.repeat(np.arange(B), tries)
+    tiles = start[level]
+    players = fixedpoint.Players(sx[level] * 8, sy[level] * 8)
+    held = np.zeros(len(level), np.int64)
+
+    # Keys held by each player on every frame, and the frame it last
+    # started the level on, to replay the ones reaching the door
+    ids = np.arange(len(level))
+    history = np.zeros((frames, len(level)), np.uint8)
+    since = np.zeros(len(level), np.int64)
+    backend = None
+
+    for frame in range(frames):
+        change = rng.random(len(level)) < 1 / CHANGE_FRAMES
+        keys = np.where(change, rng.choice(MOVES, len(level)), held)
+        pressed = keys & ~held
+        held = keys
+        history[frame, ids] = held
+
+        center = fixedpoint.step(players, tiles, held, pressed, features)
+
+        failed = np.zeros(len(level), bool)
+        for i in np.flatnonzero(center == main.TILE_DOOR):
+            if solved[level[i]]:
+                continue
+            if backend is None:
+                backend = headless.HeadlessPyxel()
+            first = since[ids[i]]
+            before = history[first-1, ids[i]] if first > 0 else 0
+            inputs = history[first:frame+1, ids[i]]
+            if replay(levels[level[i]], inputs, before, features, backend):
+                solved[level[i]] = True
+            else:
+                failed[i] = True
+
+        got_key = center == main.TILE_KEY
+        if got_key.any():
+            grids = tiles[got_key]
+            grids[grids == main.TILE_KEY] = 0
+            grids[grids == main.TILE_LOCK] = main.TILE_UNLOCKED
+            tiles[got_key] = grids
+
+        # Players through the door that the game's Player didn't follow
+        # start over too
+        x = players.x // fixedpoint.T
+        y = players.y // fixedpoint.T
+        out = (x < -2) | (x > W+1) | (y < -2) | (y > H+1) | failed
+        if out.any():
+            players.x[out] = sx[level[out]] * fixedpoint.T
+            players.y[out] = sy[level[out]] * fixedpoint.T
+            players.vx[out] = 0
+            players.vy[out] = 0
+            tiles[out] = start[level[out]]
+            since[ids[out]] = frame + 1
+
+        # Only keep playing the levels left to solve
+        playing = ~solved[level]
+        if not playing.any():
+            break
+        if not playing.all():
+            level, tiles, held, ids = level[playing], tiles[playing], held[playing], ids[playing]
+            for name in ('x', 'y', 'vx', 'vy'):
+                setattr(players, name, getattr(players, name)[playing])
+
+    return solved
+
+
+def replay(level, inputs, before, features, backend):
+    """Whether main.Player, the float physics the game plays with by
+    default, gets through the door of a level holding inputs[i] on frame i.
+
+    `before` are the keys held before the first frame.  fixedpoint only
+    matches FixedPlayer: the float player jumps a little lower, and slides
+    a little differently, so solutions found with it don't always work in
+    the game."""
+    saved = main.pyxel, main.features, main.tilemap_origin
+    main.pyxel, main.features, main.tilemap_origin = backend, features, [0, 0]
+    try:
+        backend.reset()
+        # Tiles outside of the level are empty, as in fixedpoint
+        tm = backend.tilemap(0)
+        tm.data[:] = 0
+        tm.data[:H, :W] = prepare(level[None], features)[0]
+        px, py = main.find_in_level(main.TILE_PLAYER)
+        main.erase_tile(px, py)
+        player = main.Player(px * 8, py * 8)
+
+        backend.set_input(int(before))
+        for keys in inputs:
+            backend.set_input(int(keys))
+            player.update()
+            if player.collide_door:
+                return True
+            if player.collide_key:
+                main.erase_all_tiles_like(main.TILE_KEY)
+                main.erase_all_tiles_like(main.TILE_LOCK, erase_with=main.TILE_UNLOCKED)
+            x, y = int(player.x//8), int(player.y//8)
+            if x < -2 or x > W+1 or y < -2 or y > H+1:
+                return False
+        return False
+    finally:
+        main.pyxel, main.features, main.tilemap_origin = saved
+
+
+def pick_cells(rng, mask):
+    """Pick one random cell of each mask, as flat indices, and whether
+    there was any to pick."""
+    noise = rng.random(mask.shape) * mask
+    flat = noise.reshape(len(mask), -1)
+    return flat.argmax(axis=1), flat.max(axis=1) > 0
+
+
+def generate(rng, batch, platforms=12, lock_chance=0.3):
+    levels = np.zeros((batch, H, W), np.uint16)
+    ys = np.arange(H)[None, None, :, None]
+    xs = np.arange(W)[None, None, None, :]
+
+    # Horizontal platforms, plus a broken floor
+    py = rng.integers(1, H, (batch, platforms, 1, 1))
+    px = rng.integers(-2, W, (batch, platforms, 1, 1))
+    length = rng.integers(1, 7, (batch, platforms, 1, 1))
+    blocks = ((ys == py) & (xs >= px) & (xs < px + length)).any(axis=1)
+    blocks[:, H-1] |= rng.random((batch, W)) < 0.6
+    levels[blocks] = main.TILE_BLOCK
+
+    # Some of the blocks become locks, with a key somewhere
+    standable = ~blocks & shift(blocks, -1, 0)
+    with_lock = rng.random(batch) < lock_chance
+    locks = blocks & (rng.random(blocks.shape) < 0.25) & with_lock[:, None, None]
+    levels[locks] = main.TILE_LOCK
+
+    flat = levels.reshape(batch, -1)
+    ok = np.ones(batch, bool)
+    everywhere = np.ones(batch, bool)
+    for tile, wanted in ((main.TILE_PLAYER, everywhere), (main.TILE_DOOR, everywhere),
+                         (main.TILE_KEY, with_lock)):
+        cells, found = pick_cells(rng, standable & (flat == 0).reshape(levels.shape))
+        ok &= found | ~wanted
+        place = found & wanted
+        flat[place, cells[place]] = tile
+
+    # Cacti are only decoration
+    cacti = standable & (flat == 0).reshape(levels.shape) & (rng.random(levels.shape) < 0.05)
+    levels[cacti] = main.TILE_CACTUS
+
+    return levels[ok]
+
+
+def distance(levels, a, b):
+    """Manhattan distance in tiles between tiles a and b of each level."""
+    flat = levels.reshape(len(levels), -1)
+    ay, ax = np.divmod((flat == a).argmax(axis=1), W)
+    by, bx = np.divmod((flat == b).argmax(axis=1), W)
+    return abs(ay - by) + abs(ax - bx)
+
+
+def make_pack(count, features, batch, min_distance=0, max_candidates=None,
+              seed=None):
+    rng = np.random.default_rng(seed)
+    accepted = []
+    total = 0
+    generated = 0
+    while total < count and (max_candidates is None or generated < max_candidates):
+        levels = generate(rng, batch)
+        generated += len(levels)
+        levels = levels[distance(levels, main.TILE_PLAYER, main.TILE_DOOR) >= min_distance]
+        levels = levels[solvable(levels, features, rng)]
+        accepted.append(levels)
+        total += len(levels)
+    return np.concatenate(accepted)[:count], generated
+
+
+def to_tilemap(levels):
+    """Lay levels side by side, like the columns of tilemap 1."""
+    return np.concatenate(list(levels), axis=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate solvable levels")
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--batch', type=int, default=1024)
+    parser.add_argument('--without', default='',
+                        help="comma-separated features the levels must be solvable without")
+    parser.add_argument('--min-distance', type=int, default=8,
+                        help="tiles between the player and the door")
+    parser.add_argument('--max-candidates', type=int, default=10**7,
+                        help="give up after generating that many levels")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--out', default='levels.npy')
+    parser.add_argument('--resource', help="resource file to copy levels into")
+    parser.add_argument('--column', type=int, default=main.LAST_LEVEL + 1,
+                        help="first level column to overwrite in --resource, "
+                             "after the game's levels by default")
+    args = parser.parse_args()
+
+    features = dict(main.features)
+    for name in filter(None, args.without.split(',')):
+        if name not in features:
+            parser.error("Unknown feature {}".format(name))
+        features[name] = False
+
+    start = time.perf_counter()
+    levels, generated = make_pack(
+        args.count, features, args.batch, args.min_distance,
+        args.max_candidates, args.seed)
+    elapsed = time.perf_counter() - start
+    print("{} levels out of {} candidates in {:.1f}s ({:.0f} levels/min)".format(
+        len(levels), generated, elapsed, len(levels) / elapsed * 60))
+    if len(levels) == 0:
+        parser.exit(1, "No solvable level found\n")
+
+    np.save(args.out, to_tilemap(levels))
+    print("Saved", args.out)
+
+    if args.resource:
+        levels = levels[:TILEMAP_COLUMNS - args.column]
+        headless.save_levels(args.resource, args.column, levels)
+        last = args.column + len(levels) - 1
+        print("Copied {} levels into {} from column {}, play them with:".format(
+            len(levels), args.resource, args.column))
+        print("    python main.py --level {} --last-level {}".format(args.column, last))
@@ -1,6 +1,10 @@
+import argparse
+import atexit
+import os
 import pyxel
 import numpy as np
-from functools import reduce
+
+import telemetry
 
 
 FPS = 60
@@ -11,6 +15,15 @@ GRAVITY = 12/FPS
 FRICTION_GROUND = 30/FPS
 FRICTION_AIR = .95/FPS
 
+# Same physics in integer 1/SUBPIXEL pixel units, for fixed_point mode
+SUBPIXEL = 256
+PLAYER_SPEED_FX = round(PLAYER_SPEED * SUBPIXEL)
+PLAYER_JUMP_FX = round(PLAYER_JUMP * SUBPIXEL)
+GRAVITY_FX = round(GRAVITY * SUBPIXEL)
+FRICTION_GROUND_FX = round(FRICTION_GROUND * SUBPIXEL)
+FRICTION_AIR_FX = round(FRICTION_AIR * SUBPIXEL)
+TILE_FX = 8 * SUBPIXEL
+
 TEXT_COL = 1
 TEXT_WIDTH = 4
 TEXT_HEIGHT = 6
@@ -18,9 +31,19 @@ TEXT_HEIGHT = 6
 GAME_TILES_W = 16
 GAME_TILES_H = 16
 
+# Levels bigger than the screen are .npy tile grids in LEVELS_DIR, which
+# take the place of the level with the same number in tilemap 1.  They are
+# read CHUNK_TILES square chunks at a time, and only the RESIDENT_CHUNKS x
+# RESIDENT_CHUNKS chunks around the player are kept in tilemap 0.
+LEVELS_DIR = 'levels'
+CHUNK_TILES = 16
+RESIDENT_CHUNKS = 3
+
 FIRST_LEVEL = 0
 LAST_LEVEL = 10
 
+TELEMETRY_FILE = 'telemetry.log'
+
 TILE_PLAYER = 1
 TILE_BLOCK = 32
 TILE_DOOR = 33
@@ -53,6 +76,16 @@ features = {
 sacrifices = []
 last_sacrifice = ''
 
+fixed_point = False
+
+# The door of this level ends the game, see --last-level
+last_level = LAST_LEVEL
+
+# Level tile shown at (0, 0) of tilemap 0
+tilemap_origin = [0, 0]
+
+event_log = None
+
 features_name = {
     'sprites': 'Sprites',
     'rendering': 'Rendering',
@@ -83,19 +116,34 @@ class GameError(Exception):
     """game errors"""
 
 
+def log_event(event, level, arg=0):
+    if event_log is not None:
+        event_log.log(pyxel.frame_count, event, level, arg)
+
+
 def is_tile_wall(tile):
     return tile in (TILE_BLOCK, TILE_LOCK)
 
 
+def tile_at(x, y):
+    return pyxel.tilemap(0).get(x - tilemap_origin[0], y - tilemap_origin[1])
+
+
 def is_wall(x, y):
-    return is_tile_wall(pyxel.tilemap(0).get(x, y))
+    return is_tile_wall(tile_at(x, y))
+
+
+def clamp(v, low, high):
+    """min(max(v, low), high), without the allocations of min and max."""
+    return low if v < low else high if v > high else v
 
 
 def apply_friction(v, amount):
+    # Same as max(0, v - amount) and min(0, v + amount), which allocate
     if v > 0:
-        return max(0, v - amount)
+        return v - amount if v > amount else 0
     else:
-        return min(0, v + amount)
+        return v + amount if v < -amount else 0
 
 
 PLAYER_ANIM_PERIOD = 0.25 * FPS
@@ -126,7 +174,7 @@ class Player:
         # Collisions
         top = self.col_top()
         if top != False:
-            self.vy = max(0, self.vy)
+            self.vy = self.vy if self.vy > 0 else 0
             self.y = top
             if not features['gravity'] and pyxel.btnp(pyxel.KEY_DOWN):
                 self.vy = PLAYER_SPEED
@@ -137,7 +185,7 @@ class Player:
             if features['gravity']:
                 self.vy += GRAVITY
         else:
-            self.vy = min(0, self.vy)
+            self.vy = self.vy if self.vy < 0 else 0
             self.y = bottom - self.h
 
             if features['gravity']:
@@ -157,7 +205,7 @@ class Player:
         left = self.col_left()
         if left != False:
             self.x = left
-            self.vx = max(0, self.vx)
+            self.vx = self.vx if self.vx > 0 else 0
             if not features['gravity'] and features['right'] and pyxel.btnp(pyxel.KEY_RIGHT):
                 self.vx = PLAYER_SPEED
         else:
@@ -167,7 +215,7 @@ class Player:
         right = self.col_right()
         if right != False:
             self.x = right - self.w
-            self.vx = min(0, self.vx)
+            self.vx = self.vx if self.vx < 0 else 0
             if not features['gravity'] and features['left'] and pyxel.btnp(pyxel.KEY_LEFT):
                 self.vx = -PLAYER_SPEED
         else:
@@ -180,7 +228,7 @@ class Player:
         #    for ty in range(int((self.y-1)//8), int((self.y+self.h)//8)+1)
         #]
 
-        tile = pyxel.tilemap(0).get(int(self.x+self.w/2)//8, int(self.y+self.h/2)//8)
+        tile = tile_at(int(self.x+self.w/2)//8, int(self.y+self.h/2)//8)
         self.collide_door = tile == TILE_DOOR
         self.collide_key = tile == TILE_KEY
 
@@ -199,49 +247,197 @@ class Player:
         if self.vx == 0 or not features['animations']:
             self.anim_state = 0
 
+    # The player is no bigger than a tile, so each side touches at most two
+    # tiles, f and t; checking both without a loop doesn't allocate
+
     def col_left(self):
         if features['collisions']:
             x = int((self.x-1)//8)
             f, t = int(self.y//8), int((self.y+self.h-1)//8)
-            for y in range(f, t+1):
-                if is_wall(x, y):
-                    return (x+1) * 8
+            if is_wall(x, f) or is_wall(x, t):
+                return (x+1) * 8
         return False
 
     def col_right(self):
         if features['collisions']:
             x = int((self.x+self.w)//8)
             f, t = int(self.y//8), int((self.y+self.h-1)//8)
-            for y in range(f, t+1):
-                if is_wall(x, y):
-                    return x * 8
+            if is_wall(x, f) or is_wall(x, t):
+                return x * 8
         return False
 
     def col_top(self):
         if features['collisions']:
             y = int((self.y-1)//8)
             f, t = int(self.x//8), int((self.x+self.w-1)//8)
-            for x in range(f, t+1):
-                if is_wall(x, y):
-                    return (y+1) * 8
+            if is_wall(f, y) or is_wall(t, y):
+                return (y+1) * 8
         return False
 
     def col_bottom(self):
         if features['collisions']:
             y = int((self.y+self.h)//8)
             f, t = int(self.x//8), int((self.x+self.w-1)//8)
-            for x in range(f, t+1):
-                if is_wall(x, y):
-                    return y * 8
+            if is_wall(f, y) or is_wall(t, y):
+                return y * 8
         return False
 
-    def draw(self):
+    def draw(self, camera_x=0, camera_y=0):
         if self.direction == 'r':
             frame = 1 + self.anim_state
         else:
             frame = 3 + self.anim_state
         img = 0 if features['sprites'] else 1
-        pyxel.blt(self.x, self.y, img, frame*8+4-self.w//2, 0, self.w, self.h, 0)
+        pyxel.blt(self.x - camera_x, self.y - camera_y, img,
+                  frame*8+4-self.w//2, 0, self.w, self.h, 0)
+
+
+def trunc_div(a, b):
+    """Integer division rounding toward zero, like int(a / b)."""
+    q = abs(a) // b
+    return q if a >= 0 else -q
+
+
+class FixedPlayer(Player):
+    """Player with its position and velocity in integer subpixels.
+
+    update() follows Player.update step by step, so that the game plays the
+    same, but its results don't depend on floating point rounding."""
+    def __init__(self, x, y):
+        super().__init__(x, y)
+        self.fw = self.w * SUBPIXEL
+        self.fh = self.h * SUBPIXEL
+
+    @property
+    def x(self):
+        return self.fx / SUBPIXEL
+
+    @x.setter
+    def x(self, x):
+        self.fx = round(x * SUBPIXEL)
+
+    @property
+    def y(self):
+        return self.fy / SUBPIXEL
+
+    @y.setter
+    def y(self, y):
+        self.fy = round(y * SUBPIXEL)
+
+    def update(self):
+        # Physics
+        self.fy += self.vy
+
+        if features['friction']:
+            self.vy = apply_friction(self.vy, FRICTION_AIR_FX)
+
+        # Collisions
+        top = self.col_top()
+        if top != False:
+            self.vy = self.vy if self.vy > 0 else 0
+            self.fy = top
+            if not features['gravity'] and pyxel.btnp(pyxel.KEY_DOWN):
+                self.vy = PLAYER_SPEED_FX
+
+        bottom = self.col_bottom()
+        if bottom == False:
+            # Gravity
+            if features['gravity']:
+                self.vy += GRAVITY_FX
+        else:
+            self.vy = self.vy if self.vy < 0 else 0
+            self.fy = bottom - self.fh
+
+            if features['gravity']:
+                if features['jump'] and pyxel.btnp(pyxel.KEY_UP):
+                    self.vy = -PLAYER_JUMP_FX
+            else:
+                if pyxel.btnp(pyxel.KEY_UP):
+                    self.vy = -PLAYER_SPEED_FX
+
+        self.fx += self.vx
+
+        if features['friction']:
+            self.vx = apply_friction(
+                self.vx,
+                FRICTION_GROUND_FX if (bottom and features['gravity']) else FRICTION_AIR_FX)
+
+        left = self.col_left()
+        if left != False:
+            self.fx = left
+            self.vx = self.vx if self.vx > 0 else 0
+            if not features['gravity'] and features['right'] and pyxel.btnp(pyxel.KEY_RIGHT):
+                self.vx = PLAYER_SPEED_FX
+        else:
+            if features['gravity'] and features['left'] and pyxel.btn(pyxel.KEY_LEFT):
+                self.vx = -PLAYER_SPEED_FX
+
+        right = self.col_right()
+        if right != False:
+            self.fx = right - self.fw
+            self.vx = self.vx if self.vx < 0 else 0
+            if not features['gravity'] and features['left'] and pyxel.btnp(pyxel.KEY_LEFT):
+                self.vx = -PLAYER_SPEED_FX
+        else:
+            if features['gravity'] and features['right'] and pyxel.btn(pyxel.KEY_RIGHT):
+                self.vx = PLAYER_SPEED_FX
+
+        tile = tile_at(
+            trunc_div(self.fx + self.fw//2, SUBPIXEL)//8,
+            trunc_div(self.fy + self.fh//2, SUBPIXEL)//8)
+        self.collide_door = tile == TILE_DOOR
+        self.collide_key = tile == TILE_KEY
+
+        # Animation
+        self.anim_timer += 1
+        if self.anim_timer >= PLAYER_ANIM_PERIOD:
+            self.anim_timer = 0
+            self.anim_state = (self.anim_state + 1) % 2
+
+        if self.vx < 0:
+            self.direction = 'l'
+        elif self.vx > 0:
+            self.direction = 'r'
+
+        # Suppress animations if not moving
+        if self.vx == 0 or not features['animations']:
+            self.anim_state = 0
+
+    def col_left(self):
+        if features['collisions']:
+            x = (self.fx-SUBPIXEL)//TILE_FX
+            f, t = self.fy//TILE_FX, (self.fy+self.fh-SUBPIXEL)//TILE_FX
+            if is_wall(x, f) or is_wall(x, t):
+                return (x+1) * TILE_FX
+        return False
+
+    def col_right(self):
+        if features['collisions']:
+            x = (self.fx+self.fw)//TILE_FX
+            f, t = self.fy//TILE_FX, (self.fy+self.fh-SUBPIXEL)//TILE_FX
+            if is_wall(x, f) or is_wall(x, t):
+                return x * TILE_FX
+        return False
+
+    def col_top(self):
+        if features['collisions']:
+            y = (self.fy-SUBPIXEL)//TILE_FX
+            f, t = self.fx//TILE_FX, (self.fx+self.fw-SUBPIXEL)//TILE_FX
+            if is_wall(f, y) or is_wall(t, y):
+                return (y+1) * TILE_FX
+        return False
+
+    def col_bottom(self):
+        if features['collisions']:
+            y = (self.fy+self.fh)//TILE_FX
+            f, t = self.fx//TILE_FX, (self.fx+self.fw-SUBPIXEL)//TILE_FX
+            if is_wall(f, y) or is_wall(t, y):
+                return y * TILE_FX
+        return False
+
+
+MENU_REPEAT_HOLD = 0.5 * FPS
+MENU_REPEAT_PERIOD = 0.1 * FPS
 
 
 class GuiMenu:
@@ -251,12 +447,23 @@ class GuiMenu:
         self.items = items
         self.selected = selected
 
+        # The text for each selected item, so that draw doesn't build it
+        self.texts = [
+            '\n'.join([title, ''] + [
+                (' [X] ' if i == selected else ' [ ] ') + item_names[item]
+                for i, item in enumerate(items)])
+            for selected in range(len(items))]
+        for text in self.texts:
+            prepare_textbox(text)
+
     def update(self):
-        if pyxel.btnp(pyxel.KEY_UP, 0.5 * FPS, 0.1 * FPS):
-            self.selected = max(self.selected - 1, 0)
+        if pyxel.btnp(pyxel.KEY_UP, MENU_REPEAT_HOLD, MENU_REPEAT_PERIOD):
+            if self.selected > 0:
+                self.selected -= 1
 
-        if pyxel.btnp(pyxel.KEY_DOWN, 0.5 * FPS, 0.1 * FPS):
-            self.selected = min(self.selected + 1, len(self.items)-1)
+        if pyxel.btnp(pyxel.KEY_DOWN, MENU_REPEAT_HOLD, MENU_REPEAT_PERIOD):
+            if self.selected < len(self.items)-1:
+                self.selected += 1
 
         if pyxel.btnr(pyxel.KEY_ENTER):
             return True
@@ -264,15 +471,7 @@ class GuiMenu:
         return False
 
     def draw(self):
-        text = self.title + '\n\n'
-
-        for i, item in enumerate(self.items):
-            if i == self.selected:
-                text += ' [X] ' + self.item_names[item] + '\n'
-            else:
-                text += ' [ ] ' + self.item_names[item] + '\n'
-
-        draw_textbox(text[:-1])
+        draw_textbox(self.texts[self.selected])
 
     def selected_item(self):
         return self.items[self.selected]
@@ -341,11 +540,16 @@ class Menu:
     def draw(self):
         pass
 
+    def idle(self):
+        """Whether the menu is only waiting for input, with nothing moving
+        on screen."""
+        return False
+
 
 def find_in_level(tile):
     level_map = pyxel.tilemap(0).data[:GAME_TILES_W,:GAME_TILES_H]
     y, x = np.where(level_map == tile)
-    return x[0], y[0]
+    return int(x[0]), int(y[0])
 
 
 def erase_tile(x, y, erase_with=0):
@@ -363,8 +567,16 @@ class LevelScene(Scene):
     def __init__(self, level):
         self.level = level
         self.dialog = None
-
-    def load(self):
+        self.width = GAME_TILES_W
+        self.height = GAME_TILES_H
+        self.entered = False
+
+    def load_tiles(self):
+        """Set up tilemap 0 for the level and return the player location."""
+        tilemap_origin[:] = 0, 0
+        # A streamed level before this one leaves chunks around it
+        resident = CHUNK_TILES * RESIDENT_CHUNKS
+        pyxel.tilemap(0).data[:resident, :resident] = 0
         pyxel.tilemap(0).copy(
                 0, 0, 1,
                 self.level * GAME_TILES_W, 0,
@@ -383,12 +595,28 @@ class LevelScene(Scene):
         except IndexError:
             raise GameError("No door on level {}".format(self.level))
 
-        self.player = Player(px * 8, py * 8)
+        return px, py
+
+    def erase_all(self, tile, erase_with=0):
+        erase_all_tiles_like(tile, erase_with)
+
+    def load(self):
+        px, py = self.load_tiles()
+
+        if fixed_point:
+            self.player = FixedPlayer(px * 8, py * 8)
+        else:
+            self.player = Player(px * 8, py * 8)
+
+        # Deaths and restarts load the level again, they don't enter it
+        if not self.entered:
+            log_event(telemetry.LEVEL_ENTER, self.level)
+            self.entered = True
 
         if not features['keys']:
-            erase_all_tiles_like(TILE_KEY)
+            self.erase_all(TILE_KEY)
         if not features['locks']:
-            erase_all_tiles_like(TILE_LOCK)
+            self.erase_all(TILE_LOCK)
 
         if self.level > FIRST_LEVEL:
             self.scene_stack.push_menu(SacrificeMenu())
@@ -406,22 +634,26 @@ class LevelScene(Scene):
 
         if self.player.collide_door:
             # Next level transition
+            log_event(telemetry.LEVEL_EXIT, self.level, telemetry.EXIT_DOOR)
             self.scene_stack.pop_scene()
-            if self.level < LAST_LEVEL:
-                self.scene_stack.push_scene(LevelScene(self.level + 1))
+            if self.level < last_level:
+                self.scene_stack.push_scene(new_level_scene(self.level + 1))
             else:
                 if features['tutorial']:
+                    log_event(telemetry.ENDING, self.level, telemetry.ENDING_GOOD)
                     self.scene_stack.push_menu(GoodEndgameMenu())
                 else:
+                    log_event(telemetry.ENDING, self.level, telemetry.ENDING_BAD)
                     self.scene_stack.push_menu(BadEndgameMenu())
 
         if self.player.collide_key:
-            erase_all_tiles_like(TILE_KEY)
-            erase_all_tiles_like(TILE_LOCK, erase_with=TILE_UNLOCKED)
+            self.erase_all(TILE_KEY)
+            self.erase_all(TILE_LOCK, erase_with=TILE_UNLOCKED)
 
         x, y = int(self.player.x//8), int(self.player.y//8)
-        if x < -2 or x > GAME_TILES_W+1 or y < -2 or y > GAME_TILES_H+1:
+        if x < -2 or x > self.width+1 or y < -2 or y > self.height+1:
             # Restart level if we leave the boundaries
+            log_event(telemetry.DEATH, self.level)
             if self.scene_stack.top_scene().level > FIRST_LEVEL:
                 features[sacrifices.pop()] = True
             self.load()
@@ -440,6 +672,158 @@ class LevelScene(Scene):
             draw_textbox(self.dialog, y='bottom')
 
 
+class ChunkedLevel:
+    """Tiles of a level file, read one chunk at a time.
+
+    The file is memory mapped, so only the chunks that are asked for are
+    read.  Erased tiles are remembered apart, and applied to chunks as they
+    are read again."""
+    def __init__(self, filename):
+        self.tiles = np.load(filename, mmap_mode='r')
+        self.height, self.width = self.tiles.shape
+        self.chunks = {}
+        self.erased = {}
+        self.replaced = {}
+
+    def chunk(self, cx, cy):
+        """The tiles of chunk (cx, cy), empty outside of the level."""
+        if (cx, cy) not in self.chunks:
+            C = CHUNK_TILES
+            chunk = np.zeros((C, C), np.uint16)
+            if 0 <= cx * C < self.width and 0 <= cy * C < self.height:
+                tiles = self.tiles[cy*C:(cy+1)*C, cx*C:(cx+1)*C]
+                chunk[:tiles.shape[0], :tiles.shape[1]] = tiles
+            for tile, erase_with in self.replaced.items():
+                chunk[chunk == tile] = erase_with
+            for (x, y), erase_with in self.erased.items():
+                if (x // C, y // C) == (cx, cy):
+                    chunk[y % C, x % C] = erase_with
+            self.chunks[cx, cy] = chunk
+        return self.chunks[cx, cy]
+
+    def keep_only(self, keys):
+        self.chunks = {key: self.chunks[key] for key in keys if key in self.chunks}
+
+    def find(self, tile):
+        """Location of the first tile like this one, reading a band of
+        chunks at a time."""
+        for y0 in range(0, self.height, CHUNK_TILES):
+            band = np.asarray(self.tiles[y0:y0+CHUNK_TILES])
+            y, x = np.where(band == tile)
+            if len(x) > 0:
+                return int(x[0]), y0 + int(y[0])
+        raise IndexError(tile)
+
+    def erase(self, x, y, erase_with=0):
+        self.erased[x, y] = erase_with
+        chunk = self.chunks.get((x // CHUNK_TILES, y // CHUNK_TILES))
+        if chunk is not None:
+            chunk[y % CHUNK_TILES, x % CHUNK_TILES] = erase_with
+
+    def erase_all(self, tile, erase_with=0):
+        self.replaced[tile] = erase_with
+        for chunk in self.chunks.values():
+            chunk[chunk == tile] = erase_with
+
+
+class StreamedLevelScene(LevelScene):
+    """A level bigger than the screen, with the camera following the player.
+
+    Tilemap 0 holds the chunks around the player, from tilemap_origin, and
+    is refilled whenever the player moves to another chunk."""
+    def load_tiles(self):
+        self.world = ChunkedLevel(level_file(self.level))
+        self.width, self.height = self.world.width, self.world.height
+        self.resident = None
+        if self.width < GAME_TILES_W or self.height < GAME_TILES_H:
+            raise GameError("Level {} is smaller than the screen".format(self.level))
+
+        try:
+            px, py = self.world.find(TILE_PLAYER)
+            self.world.erase(px, py)
+        except IndexError:
+            raise GameError("No player on level {}".format(self.level))
+
+        try:
+            self.world.find(TILE_DOOR)
+        except IndexError:
+            raise GameError("No door on level {}".format(self.level))
+
+        self.stream(px * 8, py * 8)
+        return px, py
+
+    def camera(self, x, y):
+        """Top left of the view around pixel (x, y), kept inside the level."""
+        return (clamp(x + 4 - GAME_TILES_W*4, 0, (self.width - GAME_TILES_W) * 8),
+                clamp(y + 4 - GAME_TILES_H*4, 0, (self.height - GAME_TILES_H) * 8))
+
+    def stream(self, x, y):
+        """Fill tilemap 0 with the chunks around the view of pixel (x, y).
+
+        The chunk in the middle of the view is always within a few tiles of
+        the player, even out of the level, so what it collides with is in
+        there too."""
+        vx, vy = self.camera(x, y)
+        cx = (vx // 8 + GAME_TILES_W // 2) // CHUNK_TILES
+        cy = (vy // 8 + GAME_TILES_H // 2) // CHUNK_TILES
+        if self.resident == (cx, cy):
+            return
+        self.resident = cx, cy
+
+        C = CHUNK_TILES
+        first = RESIDENT_CHUNKS // 2
+        data = pyxel.tilemap(0).data
+        keys = []
+        for j in range(RESIDENT_CHUNKS):
+            for i in range(RESIDENT_CHUNKS):
+                key = cx - first + i, cy - first + j
+                data[j*C:(j+1)*C, i*C:(i+1)*C] = self.world.chunk(*key)
+                keys.append(key)
+        self.world.keep_only(keys)
+        tilemap_origin[:] = (cx - first) * C, (cy - first) * C
+
+    def erase_all(self, tile, erase_with=0):
+        self.world.erase_all(tile, erase_with)
+        self.resident = None
+        self.stream(int(self.player.x), int(self.player.y))
+
+    def update(self):
+        super().update()
+
+        # Unless the level was left
+        if self.scene_stack.top_scene() is self:
+            self.stream(int(self.player.x), int(self.player.y))
+
+    def draw(self):
+        if features['sprites']:
+            pyxel.tilemap(0).refimg = 0
+        else:
+            pyxel.tilemap(0).refimg = 1
+
+        # Only the tiles in view, one more when between two tiles
+        cx, cy = self.camera(int(self.player.x), int(self.player.y))
+        tx, ty = cx // 8, cy // 8
+        pyxel.bltm(tx*8 - cx, ty*8 - cy, 0,
+                   tx - tilemap_origin[0], ty - tilemap_origin[1],
+                   GAME_TILES_W + 1, GAME_TILES_H + 1)
+
+        if features['player']:
+            self.player.draw(cx, cy)
+
+        if self.dialog is not None:
+            draw_textbox(self.dialog, y='bottom')
+
+
+def level_file(level):
+    return os.path.join(LEVELS_DIR, 'level{:02d}.npy'.format(level))
+
+
+def new_level_scene(level):
+    if os.path.exists(level_file(level)):
+        return StreamedLevelScene(level)
+    return LevelScene(level)
+
+
 class SacrificeMenu(Menu):
     def load(self):
         print(last_sacrifice)
@@ -448,8 +832,7 @@ class SacrificeMenu(Menu):
         items = [item for item in items if item in active_features]
         print(items)
 
-        selected = np.where(last_sacrifice == np.array(items))[0]
-        selected = selected[0] if len(selected) > 0 else 0
+        selected = items.index(last_sacrifice) if last_sacrifice in items else 0
         self.menu = GuiMenu("Choose a sacrifice:", features_name, items, selected)
 
     def update(self):
@@ -460,16 +843,21 @@ class SacrificeMenu(Menu):
             print("Sacrificed", features_name[feature])
             features[feature] = False
             sacrifices.append(feature)
+            log_event(telemetry.SACRIFICE, self.scene_stack.top_scene().level, feature)
             last_sacrifice = feature
 
+            scene = self.scene_stack.top_scene()
             if not features['keys']:
-                erase_all_tiles_like(TILE_KEY)
+                scene.erase_all(TILE_KEY)
             if not features['locks']:
-                erase_all_tiles_like(TILE_LOCK)
+                scene.erase_all(TILE_LOCK)
 
     def draw(self):
         self.menu.draw()
 
+    def idle(self):
+        return True
+
 
 class TextSequence:
     def __init__(self, texts, color=TEXT_COL, init_delay=0, delay=FPS):
@@ -478,6 +866,8 @@ class TextSequence:
         self.color = color
         self.delay = delay
         self.timer = -init_delay
+        for text in texts:
+            prepare_textbox(text)
 
     def update(self):
         self.timer += 1
@@ -492,6 +882,10 @@ class TextSequence:
     def get_current_text(self):
         return self.texts[self.iter]
 
+    def idle(self):
+        # The text shows up once the timer runs out, then waits for Enter
+        return self.timer > self.delay
+
     def draw(self):
         if self.timer > self.delay:
             draw_textbox(self.get_current_text(), color=self.color)
@@ -521,12 +915,19 @@ thoughts with.""",
     def draw(self):
         self.text_sequence.draw()
 
+    def idle(self):
+        return self.text_sequence.idle()
+
+
+# The bad ending is drawn in this column of tilemap 0
+BAD_ENDGAME_COLUMN = 15
+
 
 class BadEndgameScene(Scene):
     def load(self):
         pyxel.tilemap(0).copy(
                 0, 0, 0,
-                15 * GAME_TILES_W, 0,
+                BAD_ENDGAME_COLUMN * GAME_TILES_W, 0,
                 GAME_TILES_W, GAME_TILES_H)
 
     def update(self):
@@ -578,6 +979,9 @@ to say.""",
     def draw(self):
         self.text_sequence.draw()
 
+    def idle(self):
+        return self.text_sequence.idle()
+
 
 class CreditMenu(Menu):
     def __init__(self, background):
@@ -608,6 +1012,9 @@ for playing!""",
         pyxel.cls(self.background)
         self.text_sequence.draw()
 
+    def idle(self):
+        return self.text_sequence.idle()
+
 
 class PauseMenu(Menu):
     def load(self):
@@ -631,6 +1038,7 @@ class PauseMenu(Menu):
 
             # Restart level
             if selected == 'restart':
+                log_event(telemetry.RESTART, self.scene_stack.top_scene().level)
                 if self.scene_stack.top_scene().level > FIRST_LEVEL:
                     features[sacrifices.pop()] = True
                 self.scene_stack.top_scene().load()
@@ -639,9 +1047,10 @@ class PauseMenu(Menu):
             elif selected == 'previous':
                 features[sacrifices.pop()] = True
                 level = self.scene_stack.pop_scene().level
+                log_event(telemetry.LEVEL_EXIT, level, telemetry.EXIT_PREVIOUS)
                 if level-1 > FIRST_LEVEL:
                     features[sacrifices.pop()] = True
-                self.scene_stack.push_scene(LevelScene(level - 1))
+                self.scene_stack.push_scene(new_level_scene(level - 1))
 
             # Quit
             elif selected == 'quit':
@@ -650,10 +1059,14 @@ class PauseMenu(Menu):
     def draw(self):
         self.menu.draw()
 
+    def idle(self):
+        return True
+
 
 class TutorialMenu(Menu):
     def __init__(self, text):
         self.dialog = text
+        prepare_textbox(text, w=12)
 
     def update(self):
         if pyxel.btnr(pyxel.KEY_ENTER):
@@ -662,6 +1075,9 @@ class TutorialMenu(Menu):
     def draw(self):
         draw_textbox(self.dialog, w=12)
 
+    def idle(self):
+        return True
+
 
 TUTORIAL_TEXTS = [
 
@@ -781,22 +1197,80 @@ game."""
 ]
 
 
-def draw_textbox(text, x=None, y=None, w=None, h=None, color=TEXT_COL):
-    lines = text.split('\n')
-    lens = map(len, lines)
+# Size in tiles of the texts that have been shown
+textbox_sizes = {}
+
+# Windows are drawn from tilemap WINDOW_TM, where each kind of window is laid
+# out once, in one of the WINDOW_SLOT_TILES square slots; no window is bigger
+# than the screen
+WINDOW_TM = 6
+WINDOW_IMG = 2
+WINDOW_SLOT_TILES = GAME_TILES_W + 2
+WINDOW_TILES = (1, 1)
+WINDOW_TILES_PLAIN = (4, 1)
+# {window tiles: {w: {h: slot}}}, nested so that looking a slot up doesn't
+# build a key tuple.  It describes what is in WINDOW_TM, so it goes with the
+# pyxel module: headless backends each have their own
+window_slots = {}
+
+
+def textbox_size(text):
+    if text not in textbox_sizes:
+        lines = text.split('\n')
+        cols = max(map(len, lines))
+        rows = len(lines)
+        textbox_sizes[text] = (-(-cols * TEXT_WIDTH // 8),
+                               -(-rows * TEXT_HEIGHT // 8))
+    return textbox_sizes[text]
+
+
+def window_slot(w, h, tiles):
+    """Top left, in WINDOW_TM, of a window with w x h tiles inside, drawn
+    with the window tiles around `tiles` in WINDOW_IMG."""
+    slots = window_slots.get(tiles)
+    if slots is not None:
+        slots = slots.get(w)
+        if slots is not None and h in slots:
+            return slots[h]
+
+    per_row = 256 // WINDOW_SLOT_TILES
+    n = sum(len(heights) for widths in window_slots.values() for heights in widths.values())
+    if n == per_row * per_row:
+        window_slots.clear()
+        n = 0
+    u = n % per_row * WINDOW_SLOT_TILES
+    v = n // per_row * WINDOW_SLOT_TILES
+
+    # Corners, sides and middle of the window tiles
+    TSX, TSY = tiles
+    cols = np.array([TSX-1] + [TSX] * w + [TSX+1])
+    rows = np.array([TSY-1] + [TSY] * h + [TSY+1])
+    tm = pyxel.tilemap(WINDOW_TM)
+    tm.refimg = WINDOW_IMG
+    tm.data[v:v+h+2, u:u+w+2] = rows[:, None] * 32 + cols[None, :]
+    window_slots.setdefault(tiles, {}).setdefault(w, {})[h] = u, v
+    return u, v
+
+
+def prepare_textbox(text, w=None, h=None):
+    """Lay out a text box ahead of time, so that drawing it for the first
+    time doesn't allocate either."""
+    cols, rows = textbox_size(text)
+    for tiles in (WINDOW_TILES, WINDOW_TILES_PLAIN):
+        window_slot(cols if w is None else w, rows if h is None else h, tiles)
 
-    cols = reduce(max, lens)
-    rows = len(lines)
 
+def draw_textbox(text, x=None, y=None, w=None, h=None, color=TEXT_COL):
+    cols, rows = textbox_size(text)
     if w is None:
-        w = int(np.ceil(cols * TEXT_WIDTH / 8))
+        w = cols
     if h is None:
-        h = int(np.ceil(rows * TEXT_HEIGHT / 8))
+        h = rows
 
     if features['sprites']:
-        TSX, TSY = 1, 1
+        tiles = WINDOW_TILES
     else:
-        TSX, TSY = 4, 1
+        tiles = WINDOW_TILES_PLAIN
 
     if x is None:
         x = (GAME_TILES_W - w) // 2
@@ -806,22 +1280,9 @@ def draw_textbox(text, x=None, y=None, w=None, h=None, color=TEXT_COL):
         y = (GAME_TILES_H - h) - 1
 
     if features['windows']:
-        pyxel.blt((x-1)*8, (y-1)*8, 2, (TSX-1)*8, (TSY-1)*8, 8, 8, colkey=0)
-        pyxel.blt((x+w)*8, (y-1)*8, 2, (TSX+1)*8, (TSY-1)*8, 8, 8, colkey=0)
-        pyxel.blt((x-1)*8, (y+h)*8, 2, (TSX-1)*8, (TSY+1)*8, 8, 8, colkey=0)
-        pyxel.blt((x+w)*8, (y+h)*8, 2, (TSX+1)*8, (TSY+1)*8, 8, 8, colkey=0)
-
-        for i in range(w):
-            pyxel.blt((x+i)*8, (y-1)*8, 2, TSX*8, (TSY-1)*8, 8, 8, colkey=0)
-            pyxel.blt((x+i)*8, (y+h)*8, 2, TSX*8, (TSY+1)*8, 8, 8, colkey=0)
-
-        for j in range(h):
-            pyxel.blt((x-1)*8, (y+j)*8, 2, (TSX-1)*8, TSY*8, 8, 8, colkey=0)
-            pyxel.blt((x+w)*8, (y+j)*8, 2, (TSX+1)*8, TSY*8, 8, 8, colkey=0)
-
-        for i in range(w):
-            for j in range(h):
-                pyxel.blt((x+i)*8, (y+j)*8, 2, TSX*8, TSY*8, 8, 8)
+        # The middle tiles have no transparent color, so one colkey does
+        u, v = window_slot(w, h, tiles)
+        pyxel.bltm((x-1)*8, (y-1)*8, WINDOW_TM, u, v, w+2, h+2, colkey=0)
 
         pyxel.text(x*8, y*8, text, color)
 
@@ -830,8 +1291,14 @@ def draw_textbox(text, x=None, y=None, w=None, h=None, color=TEXT_COL):
         pyxel.text(x*8, y*8, text, 7)
 
 
+def any_key_down():
+    return (pyxel.btn(pyxel.KEY_UP) or pyxel.btn(pyxel.KEY_DOWN)
+            or pyxel.btn(pyxel.KEY_LEFT) or pyxel.btn(pyxel.KEY_RIGHT)
+            or pyxel.btn(pyxel.KEY_ENTER) or pyxel.btn(pyxel.KEY_TAB))
+
+
 class App:
-    def __init__(self):
+    def __init__(self, level=FIRST_LEVEL):
         pyxel.init(GAME_TILES_W*8, GAME_TILES_H*8,
             caption="Sacrifice This Game",
             fps=FPS,
@@ -840,7 +1307,11 @@ class App:
         pyxel.load("resource.pyxel")
 
         self.scene_stack = SceneStack()
-        self.scene_stack.push_scene(LevelScene(0))
+        self.scene_stack.push_scene(new_level_scene(level))
+
+        self.idle = False
+        # The idle menu on screen, which doesn't need drawing again
+        self.idle_menu = None
 
         pyxel.run(self.update, self.draw)
 
@@ -858,7 +1329,19 @@ class App:
             else:
                 pyxel.quit()
 
+        # Held keys repeat, so they need every frame
+        menu = self.scene_stack.top_menu()
+        self.idle = menu is not None and menu.idle() and not any_key_down()
+
     def draw(self):
+        # Idle frames leave the last one on screen rather than drawing it
+        # again.  Updates and input still run every frame, so btnp and btnr
+        # work as usual.
+        menu = self.scene_stack.top_menu()
+        if self.idle and self.idle_menu is menu:
+            return
+        self.idle_menu = menu if self.idle else None
+
         pyxel.cls(0)
         
         if features['rendering']:
@@ -871,5 +1354,22 @@ class App:
                 menu.draw()
 
 
-App()
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sacrifice This Game")
+    parser.add_argument('--fixed-point', action='store_true',
+                        help="integer physics, the same as fixedpoint.py and the solvers")
+    parser.add_argument('--level', type=int, default=FIRST_LEVEL,
+                        help="level to start on, e.g. the first one of a levelgen.py pack")
+    parser.add_argument('--last-level', type=int, default=LAST_LEVEL,
+                        help="level whose door ends the game")
+    args = parser.parse_args()
+    fixed_point = args.fixed_point
+    last_level = args.last_level
+
+    try:
+        event_log = telemetry.EventLog(TELEMETRY_FILE, features, FPS)
+        atexit.register(event_log.close)
+    except OSError as e:
+        print("Telemetry disabled:", e)
+    App(args.level)
 
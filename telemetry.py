@@ -0,0 +1,272 @@
+"""Gameplay event log.
+
+Events are appended to a binary file as fixed-size records, behind a header
+holding the game FPS and the feature names that sacrifice events refer to.
+A log with another header, from another version of the game or cut short,
+is renamed out of the way and a new one is started.  EventLog.log only
+queues the event; a background thread packs and writes batches of them.
+
+Run as a script to aggregate one or more logs into per-level funnels and
+sacrifice popularity tables:
+
+    python telemetry.py telemetry.log
+"""
+import argparse
+import collections
+import os
+import random
+import struct
+import threading
+import time
+
+import numpy as np
+
+
+MAGIC = b'STGE'
+HEADER = struct.Struct('<4sHI')
+RECORD = struct.Struct('<IIBBB')
+RECORD_DTYPE = np.dtype([
+    ('session', '<u4'),
+    ('frame', '<u4'),
+    ('event', 'u1'),
+    ('level', 'u1'),
+    ('arg', 'u1'),
+])
+
+LEVEL_ENTER = 1
+LEVEL_EXIT = 2
+DEATH = 3
+RESTART = 4
+SACRIFICE = 5
+ENDING = 6
+
+# Arguments of LEVEL_EXIT and ENDING
+EXIT_DOOR = 0
+EXIT_PREVIOUS = 1
+ENDING_GOOD = 0
+ENDING_BAD = 1
+
+
+def write_header(f, fps, names):
+    blob = '\n'.join(names).encode()
+    f.write(HEADER.pack(MAGIC, fps, len(blob)))
+    f.write(blob)
+
+
+def read_header(f):
+    data = f.read(HEADER.size)
+    if len(data) < HEADER.size:
+        raise ValueError("Truncated event log header")
+    magic, fps, size = HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ValueError("Not an event log")
+    blob = f.read(size)
+    if len(blob) < size:
+        raise ValueError("Truncated event log header")
+    names = blob.decode().split('\n')
+    return fps, names
+
+
+def header_matches(filename, fps, names):
+    try:
+        with open(filename, 'rb') as f:
+            return read_header(f) == (fps, names)
+    except ValueError:
+        return False
+
+
+class EventLog:
+    def __init__(self, filename, names, fps, batch_size=1024, interval=1.0):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.batch_size = batch_size
+        self.interval = interval
+        self.session = random.getrandbits(32)
+
+        if (os.path.exists(filename) and os.path.getsize(filename) > 0
+                and not header_matches(filename, fps, self.names)):
+            # Keep the log of the other version aside, it can't be added to
+            os.replace(filename, '{}.{}'.format(filename, time.strftime('%Y%m%d-%H%M%S')))
+
+        self.file = open(filename, 'ab')
+        if self.file.tell() == 0:
+            write_header(self.file, fps, self.names)
+            self.file.flush()
+
+        self.queue = collections.deque()
+        self.wakeup = threading.Event()
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def log(self, frame, event, level, arg=0):
+        if isinstance(arg, str):
+            arg = self.index[arg]
+        self.queue.append((frame, event, level, arg))
+        if len(self.queue) >= self.batch_size:
+            self.wakeup.set()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.wakeup.set()
+            self.thread.join()
+            self.file.close()
+
+    def _run(self):
+        while not self.closed:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self._flush()
+        self._flush()
+
+    def _flush(self):
+        count = len(self.queue)
+        if count == 0:
+            return
+
+        buf = bytearray(count * RECORD.size)
+        for i in range(count):
+            frame, event, level, arg = self.queue.popleft()
+            RECORD.pack_into(buf, i * RECORD.size,
+                             self.session, frame, event, level, arg)
+        self.file.write(buf)
+        self.file.flush()
+
+
+def read_chunks(filename, chunk_size):
+    with open(filename, 'rb') as f:
+        fps, names = read_header(f)
+        yield fps, names
+        while True:
+            chunk = np.fromfile(f, RECORD_DTYPE, chunk_size)
+            if len(chunk) == 0:
+                break
+            yield chunk
+
+
+class Aggregate:
+    def __init__(self):
+        self.fps = None
+        self.names = None
+        self.enters = np.zeros(256, np.int64)
+        self.exits = np.zeros(256, np.int64)
+        self.previous = np.zeros(256, np.int64)
+        self.deaths = np.zeros(256, np.int64)
+        self.restarts = np.zeros(256, np.int64)
+        self.time_total = np.zeros(256, np.int64)
+        self.time_count = np.zeros(256, np.int64)
+        self.sacrifices = np.zeros((256, 256), np.int64)
+        self.endings = np.zeros(2, np.int64)
+        # Last level entry of each session, as (frame, level), carried over
+        # from one chunk to the next
+        self.entered = {}
+
+    def add_file(self, filename, chunk_size):
+        chunks = read_chunks(filename, chunk_size)
+        fps, names = next(chunks)
+        if self.names is None:
+            self.fps, self.names = fps, names
+        elif (fps, names) != (self.fps, self.names):
+            raise ValueError(
+                "{} was written by another version of the game".format(filename))
+
+        for chunk in chunks:
+            self.add_chunk(chunk)
+
+    def count(self, chunk, event, arg=None):
+        mask = chunk['event'] == event
+        if arg is not None:
+            mask &= chunk['arg'] == arg
+        return np.bincount(chunk['level'][mask], minlength=256)
+
+    def add_chunk(self, chunk):
+        self.enters += self.count(chunk, LEVEL_ENTER)
+        self.exits += self.count(chunk, LEVEL_EXIT, EXIT_DOOR)
+        self.previous += self.count(chunk, LEVEL_EXIT, EXIT_PREVIOUS)
+        self.deaths += self.count(chunk, DEATH)
+        self.restarts += self.count(chunk, RESTART)
+
+        sacrifices = chunk[chunk['event'] == SACRIFICE]
+        np.add.at(self.sacrifices, (sacrifices['level'], sacrifices['arg']), 1)
+
+        endings = chunk[chunk['event'] == ENDING]
+        self.endings += np.bincount(endings['arg'], minlength=2)[:2]
+
+        self.add_times(chunk)
+
+    def add_times(self, chunk):
+        """Time from entering a level to leaving it through a door."""
+        rows = chunk[(chunk['event'] == LEVEL_ENTER) | (chunk['event'] == LEVEL_EXIT)]
+        if len(rows) == 0:
+            return
+
+        # Entries carried over from previous chunks go first
+        carried = np.zeros(len(self.entered), RECORD_DTYPE)
+        for i, (session, (frame, level)) in enumerate(self.entered.items()):
+            carried[i] = (session, frame, LEVEL_ENTER, level, 0)
+        rows = np.concatenate([carried, rows])
+        rows = rows[np.argsort(rows['session'], kind='stable')]
+
+        index = np.arange(len(rows))
+        is_enter = rows['event'] == LEVEL_ENTER
+        last_enter = np.maximum.accumulate(np.where(is_enter, index, -1))
+
+        exits = ((rows['event'] == LEVEL_EXIT) & (rows['arg'] == EXIT_DOOR)
+                 & (last_enter >= 0))
+        exits[exits] &= (rows['session'][last_enter[exits]] == rows['session'][exits])
+        entries = rows[last_enter[exits]]
+        times = rows['frame'][exits].astype(np.int64) - entries['frame']
+        self.time_total += np.bincount(entries['level'], times, 256).astype(np.int64)
+        self.time_count += np.bincount(entries['level'], minlength=256)
+
+        # Remember the sessions whose last event is an entry
+        last = np.r_[rows['session'][1:] != rows['session'][:-1], True]
+        self.entered = {
+            int(row['session']): (int(row['frame']), int(row['level']))
+            for row in rows[last & is_enter]
+        }
+
+    def report(self):
+        levels = np.nonzero(self.enters)[0]
+
+        print("Level  Entered  Completed  Previous  Deaths  Restarts  Avg time")
+        for level in levels:
+            if self.time_count[level] > 0:
+                avg = '{:.1f}s'.format(
+                    self.time_total[level] / self.time_count[level] / self.fps)
+            else:
+                avg = '-'
+            print("{:5}  {:7}  {:9}  {:8}  {:6}  {:8}  {:>8}".format(
+                level, self.enters[level], self.exits[level],
+                self.previous[level], self.deaths[level],
+                self.restarts[level], avg))
+
+        print()
+        print("Sacrifices")
+        totals = self.sacrifices.sum(axis=0)
+        for feature in np.argsort(-totals, kind='stable'):
+            if totals[feature] == 0:
+                break
+            by_level = ', '.join(
+                '{}: {}'.format(level, self.sacrifices[level, feature])
+                for level in np.nonzero(self.sacrifices[:, feature])[0])
+            print("{:>12}  {:7}  ({})".format(
+                self.names[feature], totals[feature], by_level))
+
+        print()
+        print("Endings: {} good, {} bad".format(*self.endings))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Aggregate gameplay event logs")
+    parser.add_argument('logs', nargs='+')
+    parser.add_argument('--chunk', type=int, default=1 << 20,
+                        help="events read at once")
+    args = parser.parse_args()
+
+    aggregate = Aggregate()
+    for filename in args.logs:
+        aggregate.add_file(filename, args.chunk)
+    aggregate.report()
@@ -0,0 +1,53 @@
+import contextlib
+import os
+
+import numpy as np
+
+import fixedpoint
+import headless
+import main
+
+
+PHYSICS = ['friction', 'gravity', 'jump', 'left', 'right', 'collisions']
+MOVES = [0] + [1 << headless.KEYS.index(name) for name in ('UP', 'DOWN', 'LEFT', 'RIGHT')] + [
+    (1 << headless.KEYS.index('UP')) | (1 << headless.KEYS.index('RIGHT')),
+    (1 << headless.KEYS.index('UP')) | (1 << headless.KEYS.index('LEFT')),
+]
+
+
+def test_step_matches_fixed_player():
+    rng = np.random.default_rng(0)
+    W, H = main.GAME_TILES_W, main.GAME_TILES_H
+    compared = 0
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for level in range(main.FIRST_LEVEL, main.LAST_LEVEL + 1):
+            for _ in range(4):
+                sacrifices = ['tutorial'] + list(rng.choice(PHYSICS, rng.integers(0, 3), replace=False))
+                app = headless.HeadlessApp(headless.HeadlessPyxel(), level, sacrifices,
+                                           fixed_point=True)
+                app.scene_stack.clear_menus()
+                held = 0
+                for frame in range(300):
+                    if frame % 20 == 0:
+                        keys = int(rng.choice(MOVES))
+                    pressed = keys & ~held
+                    held = keys
+
+                    scene = app.scene_stack.top_scene()
+                    player = scene.player
+                    players = fixedpoint.Players([0], [0])
+                    players.x, players.y = np.array([player.fx]), np.array([player.fy])
+                    players.vx, players.vy = np.array([player.vx]), np.array([player.vy])
+                    tiles = app.backend.tilemap(0).data[:H, :W].copy()
+
+                    app.step(keys)
+                    center = fixedpoint.step(players, tiles, np.array([held]),
+                                             np.array([pressed]), main.features)
+                    if app.scene_stack.top_scene() is not scene or scene.player is not player:
+                        break  # through the door, or restarted
+
+                    assert (player.fx, player.fy, player.vx, player.vy) == (
+                        players.x[0], players.y[0], players.vx[0], players.vy[0]), (level, frame)
+                    assert player.collide_door == (center[0] == main.TILE_DOOR)
+                    compared += 1
+    assert compared > 5000
@@ -0,0 +1,35 @@
+import fuzz
+import headless
+
+
+def softlock(level, sacrifices, player=None):
+    app = headless.HeadlessApp(headless.HeadlessPyxel(), level, sacrifices)
+    app.scene_stack.clear_menus()
+    if player is not None:
+        app.scene_stack.top_scene().player.x, app.scene_stack.top_scene().player.y = player
+    return fuzz.check_softlock(app)
+
+
+def test_door_out_of_reach():
+    # The door of level 0 is up on a platform
+    assert softlock(0, ['tutorial']) is None
+    assert softlock(0, ['tutorial', 'jump']) == 'no reachable door on level 0 without jump, tutorial'
+
+
+def test_door_behind_locks():
+    # The door of level 3 is walled in by locks, and the key opens them
+    assert softlock(3, ['tutorial']) is None
+    assert softlock(3, ['tutorial', 'locks']) is None
+    assert softlock(3, ['tutorial', 'keys']) == 'no reachable door on level 3 without keys, tutorial'
+
+
+def test_player_just_off_the_edge():
+    # Still alive, falling or walking back in
+    for player in ((132.8, 40), (143, 40), (-16, 40), (40, -16), (40, 143)):
+        assert softlock(0, ['tutorial'], player) is None
+
+
+def test_repro_options(tmp_path):
+    filename = fuzz.save_repro(str(tmp_path), b'\x01\x01', ('softlock', 'detail'), 5, True)
+    assert fuzz.load_repro_options(filename) == (5, True)
+    assert headless.load_inputs(filename) == b'\x01\x01'
@@ -0,0 +1,24 @@
+import host
+import main
+
+
+def test_create_prints_nothing(capsys):
+    # Levels after the first one open with the sacrifice menu, which prints
+    host.Host().create(level=1)
+    assert capsys.readouterr().out == ''
+
+
+def test_sessions_lay_out_their_own_windows():
+    h = host.Host()
+    sessions = [h.create(level=1), h.create(level=1)]
+    for _ in range(3):
+        h.tick()
+
+    for session in sessions:
+        session.app.activate()
+        tm = session.app.backend.tilemap(main.WINDOW_TM).data
+        for tiles in (main.WINDOW_TILES, main.WINDOW_TILES_PLAIN):
+            u, v = main.window_slot(5, 2, tiles)
+            TSX, TSY = tiles
+            assert tm[v, u] == (TSY-1) * 32 + TSX-1
+            assert tm[v+3, u+6] == (TSY+1) * 32 + TSX+1
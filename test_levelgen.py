@@ -0,0 +1,145 @@
+import numpy as np
+
+import fixedpoint
+import levelgen
+import headless
+import main
+
+
+TILES = {'.': 0, '#': main.TILE_BLOCK, 'D': main.TILE_DOOR,
+         'c': main.TILE_CACTUS, 'P': main.TILE_PLAYER,
+         'L': main.TILE_LOCK, 'k': main.TILE_KEY}
+KEY = levelgen.KEY
+
+
+def parse(rows):
+    return np.array([[TILES[c] for c in row] for row in rows], np.uint16)
+
+
+def without(*names):
+    features = dict(main.features)
+    for name in names:
+        features[name] = False
+    return features
+
+
+# Found by make_pack(4000, without('jump'), 1024, 8, seed=2).  The tile model
+# lets the player drift around the platforms while falling, but a search of
+# every (x, y, vx, vy) the player can be in never gets to the door.
+UNSOLVABLE_WITHOUT_JUMP = parse([
+    '................',
+    '........########',
+    '...##..###......',
+    '................',
+    '................',
+    '.............###',
+    '................',
+    '........c.......',
+    '..#######.......',
+    '...P............',
+    '####............',
+    '................',
+    '.......c........',
+    '.......########.',
+    '...........D....',
+    '..#####.#..####.',
+])
+
+WALK_TO_DOOR = parse([
+    '................',
+] * 13 + [
+    '..P.......D.....',
+    '################',
+    '................',
+])
+
+# Found by search() without jump.  Walking off the ledge to the right, the
+# fixed-point player lands on the block at the bottom right and walks to the
+# door, while the float one drifts a few pixels further out and falls past it.
+EDGE_LANDING = parse([
+    '................',
+    '.##.............',
+    '................',
+    '................',
+    '..............c.',
+    '...........#L##L',
+    '....LL#........P',
+    '............####',
+    'LL..............',
+    '............##LL',
+    '.k......#.......',
+    '.#L.............',
+    '............###L',
+    '.......#LLL##...',
+    '..........D.....',
+    '#.#...#L.L#.##.#',
+])
+EDGE_LANDING_KEYS = [0] * 2 + [KEY['DOWN'] | KEY['RIGHT']] * 20 + [KEY['LEFT']] * 60
+
+
+def fixed_point_reaches_door(level, inputs, features):
+    start = levelgen.prepare(level[None], features)
+    (_, y, x), = np.argwhere(start == main.TILE_PLAYER)
+    start[start == main.TILE_PLAYER] = 0
+    players = fixedpoint.Players([x * 8], [y * 8])
+    held = 0
+    for keys in inputs:
+        center = fixedpoint.step(players, start, np.array([keys]),
+                                 np.array([keys & ~held]), features)
+        held = keys
+        if center[0] == main.TILE_DOOR:
+            return True
+    return False
+
+
+def test_tile_model_is_generous():
+    assert levelgen.reachable(UNSOLVABLE_WITHOUT_JUMP[None], without('jump'))[0]
+
+
+def test_unsolvable_level_is_rejected():
+    assert not levelgen.solvable(UNSOLVABLE_WITHOUT_JUMP[None], without('jump'), 0)[0]
+
+
+def test_solvable_level_is_accepted():
+    assert levelgen.solvable(WALK_TO_DOOR[None], without('jump'), 0)[0]
+    assert not levelgen.solvable(WALK_TO_DOOR[None], without('jump', 'right'), 0)[0]
+
+
+def test_replay_uses_game_physics():
+    features = without('jump')
+    backend = headless.HeadlessPyxel()
+    assert fixed_point_reaches_door(EDGE_LANDING, EDGE_LANDING_KEYS, features)
+    assert not levelgen.replay(EDGE_LANDING, EDGE_LANDING_KEYS, 0, features, backend)
+    assert levelgen.replay(WALK_TO_DOOR, [KEY['RIGHT']] * 120, 0, features, backend)
+    assert not levelgen.replay(WALK_TO_DOOR, [KEY['LEFT']] * 120, 0, features, backend)
+
+
+def test_pack_levels_are_solved():
+    features = without('jump')
+    levels, _ = levelgen.make_pack(20, features, 256, 8, seed=2)
+    assert len(levels) == 20
+    assert levelgen.search(levels, features, 1).all()
+
+
+def test_pack_after_the_last_level_can_be_played(monkeypatch):
+    # What levelgen.py --resource writes, and main.py --level 11
+    # --last-level 12 plays
+    images, tilemaps = headless.load_resource('resource.pyxel')
+    data, refimg = tilemaps[1]
+    data = data.copy()
+    first = main.LAST_LEVEL + 1
+    data[:16, first*16:(first+2)*16] = levelgen.to_tilemap([WALK_TO_DOOR] * 2)
+    tilemaps[1] = data, refimg
+    monkeypatch.setattr(main, 'last_level', first + 1)
+
+    app = headless.HeadlessApp(headless.HeadlessPyxel(resource=(images, tilemaps)), first)
+    endings = (main.GoodEndgameMenu, main.BadEndgameMenu)
+    levels = []
+    for _ in range(300):
+        if isinstance(app.scene_stack.top_menu(), endings):
+            break
+        app.scene_stack.clear_menus()
+        levels.append(app.scene_stack.top_scene().level)
+        app.step(KEY['RIGHT'])
+    assert isinstance(app.scene_stack.top_menu(), endings)
+    assert sorted(set(levels)) == [first, first + 1]
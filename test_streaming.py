@@ -0,0 +1,65 @@
+import contextlib
+import os
+
+import numpy as np
+
+import headless
+import main
+
+
+W, H = 64, 20
+
+
+def make_level():
+    tiles = np.zeros((H, W), np.uint16)
+    tiles[H-2] = main.TILE_BLOCK
+    tiles[10, ::3] = main.TILE_BLOCK
+    tiles[H-3, 2] = main.TILE_PLAYER
+    tiles[H-3, W-4] = main.TILE_DOOR
+    return tiles
+
+
+def play_streamed_level(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, 'LEVELS_DIR', str(tmp_path))
+    tiles = make_level()
+    np.save(main.level_file(0), tiles)
+    world = tiles.copy()
+    world[world == main.TILE_PLAYER] = 0
+
+    app = headless.HeadlessApp(headless.HeadlessPyxel(), 0, ['tutorial'])
+    right = 1 << headless.KEYS.index('RIGHT')
+    origins = set()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(W * 8):
+            scene = app.scene_stack.top_scene()
+            if scene.level != 0:
+                break
+            origins.add(tuple(app.tilemap_origin))
+
+            # The tiles around the player are the ones of the level
+            app.activate()
+            px, py = int(scene.player.x) // 8, int(scene.player.y) // 8
+            for y in range(py - 1, py + 3):
+                for x in range(px - 1, px + 3):
+                    expected = world[y, x] if 0 <= x < W and 0 <= y < H else 0
+                    assert main.tile_at(x, y) == expected, (x, y)
+
+            app.step(right)
+    return app, origins
+
+
+def test_crossing_chunks(tmp_path, monkeypatch):
+    app, origins = play_streamed_level(tmp_path, monkeypatch)
+    assert app.scene_stack.top_scene().level == 1
+    assert len({x for x, _ in origins}) >= 3
+
+
+def test_level_after_streamed_level(tmp_path, monkeypatch):
+    app, _ = play_streamed_level(tmp_path, monkeypatch)
+
+    # Only level 1 is left in tilemap 0, nothing around it to collide with
+    data = app.backend.tilemap(0).data
+    resident = main.CHUNK_TILES * main.RESIDENT_CHUNKS
+    assert app.tilemap_origin == [0, 0]
+    assert not data[:resident, main.GAME_TILES_W:resident].any()
+    assert not data[main.GAME_TILES_H:resident, :resident].any()
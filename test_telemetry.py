@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+import telemetry
+
+
+NAMES = ['jump', 'left']
+
+
+def log(filename, names=NAMES):
+    event_log = telemetry.EventLog(filename, names, 60)
+    event_log.log(1, telemetry.LEVEL_ENTER, 0)
+    event_log.close()
+
+
+def events(filename):
+    chunks = telemetry.read_chunks(filename, 1024)
+    header = next(chunks)
+    return header, sum(len(chunk) for chunk in chunks)
+
+
+def test_append(tmp_path):
+    filename = str(tmp_path / 'telemetry.log')
+    log(filename)
+    log(filename)
+    assert events(filename) == ((60, NAMES), 2)
+
+
+@pytest.mark.parametrize('contents', [b'ST', b'STGE\x3c\x00\xff\x00\x00\x00jump', b'not a log'])
+def test_bad_header_is_rotated(tmp_path, contents):
+    filename = str(tmp_path / 'telemetry.log')
+    with open(filename, 'wb') as f:
+        f.write(contents)
+    log(filename)
+    assert events(filename) == ((60, NAMES), 1)
+    assert len(os.listdir(str(tmp_path))) == 2
+
+
+def test_other_version_is_rotated(tmp_path):
+    filename = str(tmp_path / 'telemetry.log')
+    log(filename, ['jump'])
+    log(filename)
+    assert events(filename) == ((60, NAMES), 1)
+    assert len(os.listdir(str(tmp_path))) == 2
+
+
+def test_truncated_header_is_an_error(tmp_path):
+    filename = str(tmp_path / 'telemetry.log')
+    with open(filename, 'wb') as f:
+        f.write(b'ST')
+    with pytest.raises(ValueError):
+        events(filename)